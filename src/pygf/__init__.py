@@ -1,28 +1,112 @@
 VERSION = "0.1.0"
 
-from collections import UserDict
+import itertools
+import threading
+from collections.abc import MutableMapping
 from contextlib import contextmanager
+from contextvars import ContextVar
 
+# marks a parameter deleted in a scope
+_DELETED = object()
+
+# each scope has its own version, so that caches can detect any change
+_versions = itertools.count()
+
+
+class _Scope:
+    """an immutable set of parameters: some values over the parameters of a parent scope"""
+
+    __slots__ = ("_merged", "parent", "values", "version")
+
+    def __init__(self, values, parent=None):
+        self.values = values
+        self.parent = parent
+        self.version = next(_versions)
+        self._merged = None
+
+    def merged(self):
+        """returns all the parameters of the scope (computed once), which must not be modified"""
+        if self._merged is None:
+            merged = {} if self.parent is None else dict(self.parent.merged())
+            for key, value in self.values.items():
+                if value is _DELETED:
+                    merged.pop(key, None)
+                else:
+                    merged[key] = value
+            self._merged = merged
+        return self._merged
+
+    def with_value(self, key, value):
+        """returns a copy of the scope where a parameter is changed"""
+        return _Scope({**self.values, key: value}, self.parent)
+
+
+class Params(MutableMapping):
+    """The global parameters of the drawings.
+
+    Outside of :meth:`context`, the parameters are shared by the whole process.
+    Inside, they are local to the current thread (or asyncio task), so that
+    drawings with different parameters can be made concurrently.
+
+    ``version`` changes each time the parameters change, so that caches can detect it.
+    """
 
-class Params(UserDict):
     def __init__(self, default):
-        super().__init__(default)
-    
+        self._root = _Scope(dict(default))
+        self._lock = threading.Lock()
+        self._scope = ContextVar(f"pygf params {id(self)}")
+
+    def _current(self):
+        return self._scope.get(self._root)
+
+    @property
+    def version(self):
+        return self._current().version
+
+    def __getitem__(self, key):
+        return self._current().merged()[key]
+
+    def __iter__(self):
+        return iter(self._current().merged())
+
+    def __len__(self):
+        return len(self._current().merged())
+
+    def __contains__(self, key):
+        return key in self._current().merged()
+
+    def _set(self, key, value):
+        scope = self._scope.get(None)
+        if scope is not None:
+            # the scopes are immutable: the context gets a modified copy of its own
+            self._scope.set(scope.with_value(key, value))
+            return
+        with self._lock:
+            self._root = self._root.with_value(key, value)
+
+    def __setitem__(self, key, value):
+        self._set(key, value)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._set(key, _DELETED)
+
     @contextmanager
     def context(self, temp_params=None):
-        if temp_params is None:
-            temp_params = {}
-        # sauvegarde
-        old = copy.deepcopy(self.data)
-        # applique temporairement
-        self.update(temp_params)
+        """Change some parameters temporarily, for the current thread or task only
+
+        :param temp_params: the parameters to change
+        :type temp_params: dict
+
+        The parameters changed inside the context are restored at its end.
+        """
+        token = self._scope.set(_Scope(dict(temp_params or {}), self._current()))
         try:
             yield self
         finally:
-            # restauration
-            self.data.clear()
-            self.data.update(old)
-            
+            self._scope.reset(token)
+
 
 _default = {
     "draw": "black",
@@ -30,5 +114,3 @@ _default = {
 }
 
 params = Params(_default)
-
-            
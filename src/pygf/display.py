@@ -0,0 +1,446 @@
+"""The display list module: a backend-neutral representation of what is drawn"""
+
+# pylint: disable=invalid-name
+from __future__ import annotations
+
+import os
+import pickle
+import tempfile
+from collections import OrderedDict
+from collections.abc import Callable, Hashable, Iterator
+from contextlib import ExitStack
+from dataclasses import dataclass
+from functools import cached_property
+from typing import IO, Any
+
+from pygf import params
+from pygf.geometry import GridIndex, Point, PointArray, Rectangle, Transform
+
+
+class StyleCache:
+    """A LRU cache for resolved styles.
+
+    :param maxsize: the maximal number of entries in the cache
+
+    The number of lookups that were found in the cache (resp. were not)
+    are available as ``hits`` (resp. ``misses``).
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self.entries: OrderedDict[Hashable, Any] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable | None, compute: Callable[[], Any]) -> Any:
+        """returns the value associated to the key, calling ``compute``
+        to obtain it if it is not in the cache.
+
+        If the key is None, the value is not cached.
+        The value must not be modified by the caller.
+        """
+        if key is None:
+            self.misses += 1
+            return compute()
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            value = self.entries[key] = compute()
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+            return value
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def clear(self):
+        """empties the cache and resets the counters"""
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# shared by all layers
+style_cache = StyleCache()
+
+
+def style_key(style: dict[str, Any] | None) -> tuple | None:
+    """returns a hashable key that identifies the style, along with
+    the current global parameters, or None if the style is not hashable"""
+    key = (tuple(style.items()) if style else (), params.version)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def resolve_style(style: dict[str, Any] | None, key: tuple | None = None) -> dict[str, Any]:
+    """returns the style to use for a primitive: the global parameters,
+    overridden by the per-primitive style
+
+    :param key: the key of the style, as given by :func:`style_key`
+    """
+
+    def compute():
+        s = {}
+        s.update(params)
+        if style is not None:
+            s.update(style)
+        return s
+
+    if key is None:
+        return compute()
+    return style_cache.get(("style", key), compute)
+
+
+@dataclass
+class Primitive:
+    """
+    represents one drawing command, once its geometry is resolved
+    and its style is normalized, but before any backend sees it.
+
+    The points are in the user coordinates: each layer applies its own transform.
+    The style is already merged with the global parameters and must
+    not be modified by the backends. Primitives with the same ``style_key``
+    have the same style, which allows backends to cache their parsing of the style.
+    """
+
+    kind: str
+    points: list[Point] | PointArray
+    style: dict[str, Any]
+    labels: dict | None = None
+    z_index: int = 0
+    closed: bool = False
+    # edges only: the angle (in degrees) at which the curve passes through each point
+    angles: list[float] | None = None
+    # circles only
+    radius: float = 0
+    # texts only
+    text: str = ""
+    # pictures only
+    img_name: str = ""
+    width: float = 0
+    height: float = 0
+    # instances only: the template (a DisplayList) and where it is placed
+    template: Any = None
+    transform: Transform | None = None
+    # None if the style cannot be cached
+    style_key: tuple | None = None
+
+    @classmethod
+    def build(
+        cls: type[Primitive],
+        kind: str,
+        points: list[Point] | PointArray,
+        style: dict[str, Any],
+        labels: dict | None = None,
+        z_index: int = 0,
+        closed: bool = False,
+        **fields,
+    ) -> Primitive:
+        """builds a primitive from the style given by the user"""
+        # pylint: disable=too-many-arguments
+        key = style_key(style)
+        return cls(kind, points, resolve_style(style, key), labels, z_index, closed, style_key=key, **fields)
+
+    @cached_property
+    def bounding_box(self) -> Rectangle | None:
+        """the bounding box of the primitive, in the user coordinates
+        (None if the primitive should always be drawn)
+
+        Texts and pictures are not transformed like the rest of the picture,
+        so they have no bounding box in the user coordinates: the layers compute
+        the box of the pictures in the output coordinates, and texts, whose size
+        in the output is not known, have none. Neither have the instances
+        of a template that contains some.
+        """
+        if self.kind in ("text", "picture"):
+            return None
+        if self.template is not None and not self.template.bounded():
+            return None
+        if self.kind == "circle":
+            (center, radius) = (self.points[0], self.radius)
+            return Rectangle(center - Point(radius, radius), center + Point(radius, radius))
+        box = Rectangle.bounding_box(self.points)
+        if self.kind == "edge":
+            # the control points of the curves are not too far from the points
+            looseness = abs(self.style.get("looseness", 1))
+            points = self.points
+            box = box.enlarge(
+                max(looseness * 0.3902 * points[i].distance(points[i + 1]) for i in range(len(points) - 1))
+            )
+        return box
+
+
+class _TemporaryFiles:
+    """The temporary files of a buffer and of its forks, which share them:
+    they are closed once all these buffers are closed."""
+
+    def __init__(self):
+        self.stack = ExitStack()
+        # number of buffers that use the files
+        self.users = 1
+
+    def new(self) -> IO[bytes]:
+        """returns a new temporary file"""
+        return self.stack.enter_context(tempfile.TemporaryFile())
+
+    def release(self):
+        """called when a buffer that uses the files is closed"""
+        self.users -= 1
+        if self.users == 0:
+            self.stack.close()
+
+
+class ZBuffer:
+    """The output of a layer, sorted by z-index.
+
+    Each item (whose type depends on the layer) is stored with the bounding box,
+    in the output coordinates, of the primitive it comes from
+    (None if the item should always be drawn).
+
+    The buffer can maintain a spatial index over these bounding boxes
+    (see :meth:`build_index`), which is then used to find the visible items
+    and to find the primitives in a given region.
+
+    For huge drawings, the items can be stored in temporary files
+    instead of memory (see :meth:`spill`).
+
+    A buffer can be forked (see :meth:`fork`): the items added before
+    are then shared by both buffers.
+
+    The temporary files are removed when the buffer is closed (see :meth:`close`).
+    """
+
+    def __init__(self):
+        # node = 1
+        # edge = 0
+        self.items: dict[int, list[tuple[Any, Rectangle | None]]] = {0: [], 1: []}
+        self.index: GridIndex | None = None
+        # positions of the items without bounding box
+        self.unbounded: dict[int, list[int]] = {0: [], 1: []}
+        # number of items in memory above which they are written to a file
+        self.spill_threshold: int | None = None
+        # the file where the items are written, in chunks
+        self.files: dict[int, IO[bytes]] = {}
+        # the items that were added before the last fork, which must not be modified:
+        # lists of pairs (item, bbox) or files
+        self.shared: dict[int, tuple[list[tuple[Any, Rectangle | None]] | IO[bytes], ...]] = {}
+        # the indexes of the shared items, each with the number of its entries that are shared
+        self.shared_indexes: list[tuple[GridIndex, int]] = []
+        # number of items stored before the items in memory
+        self.offset: dict[int, int] = {}
+        # whether some items are on disk
+        self.on_disk = False
+        # the temporary files, shared with the forks (None until some items are spilled)
+        self.temporary_files: _TemporaryFiles | None = None
+        self.closed = False
+
+    def add(self, z_index: int, x: Any, bbox: Rectangle | None = None, primitive: Primitive | None = None):
+        """adds an item
+
+        :param z_index: the z-index of the item
+        :param x: the item
+        :param bbox: the bounding box of the item
+        :param primitive: the primitive the item comes from
+        """
+        if z_index not in self.items:
+            self.items[z_index] = []
+            self.unbounded[z_index] = []
+        items = self.items[z_index]
+        position = self.offset.get(z_index, 0) + len(items)
+        if bbox is None:
+            self.unbounded[z_index].append(position)
+        elif self.index is not None:
+            self.index.insert(bbox, (z_index, position, primitive))
+        items.append((x, bbox))
+        if self.spill_threshold is not None and len(items) >= self.spill_threshold:
+            self._spill(z_index)
+
+    def spill(self, threshold: int):
+        """starts writing the items to temporary files, once there are
+        ``threshold`` items of the same z-index in memory
+
+        The items must be picklable. Note that a spatial index keeps
+        the bounding boxes and the primitives in memory.
+
+        :param threshold: the maximal number of items of each z-index kept in memory
+        :type threshold: int
+        """
+        self.spill_threshold = threshold
+        for z_index, items in self.items.items():
+            if len(items) >= threshold:
+                self._spill(z_index)
+
+    def _spill(self, z_index: int):
+        if self.closed:
+            raise ValueError("the items of a closed buffer cannot be spilled")
+        if z_index not in self.files:
+            if self.temporary_files is None:
+                self.temporary_files = _TemporaryFiles()
+            self.files[z_index] = self.temporary_files.new()
+            self.on_disk = True
+        f = self.files[z_index]
+        f.seek(0, os.SEEK_END)
+        pickle.dump(self.items[z_index], f, pickle.HIGHEST_PROTOCOL)
+        self.offset[z_index] = self.offset.get(z_index, 0) + len(self.items[z_index])
+        self.items[z_index] = []
+
+    @staticmethod
+    def _read(segment) -> Iterator[tuple[Any, Rectangle | None]]:
+        if isinstance(segment, list):
+            yield from segment
+            return
+        segment.seek(0)
+        while True:
+            try:
+                chunk = pickle.load(segment)
+            except EOFError:
+                break
+            yield from chunk
+
+    def close(self):
+        """releases the temporary files of the buffer
+
+        The files shared with forks are only removed once all of them are closed.
+        A buffer whose items were spilled cannot be read once it is closed.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self.temporary_files is not None:
+            self.temporary_files.release()
+
+    def _check_open(self):
+        if self.closed and self.on_disk:
+            raise ValueError("the items of a closed buffer are no longer available")
+
+    def stored(self, z_index: int) -> Iterator[tuple[Any, Rectangle | None]]:
+        """yields the pairs ``(item, bbox)`` of a z-index, in the order they were added"""
+        self._check_open()
+        for segment in self.shared.get(z_index, ()):
+            yield from self._read(segment)
+        if z_index in self.files:
+            yield from self._read(self.files[z_index])
+        yield from self.items[z_index]
+
+    def fork(self) -> ZBuffer:
+        """returns a new buffer with the same items
+
+        The items are not copied: both buffers share them,
+        and the items added afterwards to one buffer are not seen by the other.
+        Both buffers must be closed for the shared temporary files to be removed.
+        """
+        self._check_open()
+        for z_index, items in self.items.items():
+            # the current items become immutable
+            shared = self.shared.get(z_index, ())
+            if z_index in self.files:
+                shared += (self.files.pop(z_index),)
+            if items:
+                shared += (items,)
+                self.offset[z_index] = self.offset.get(z_index, 0) + len(items)
+                self.items[z_index] = []
+            self.shared[z_index] = shared
+
+        child = ZBuffer()
+        child.items = {z_index: [] for z_index in self.items}
+        child.unbounded = {z_index: list(positions) for (z_index, positions) in self.unbounded.items()}
+        child.spill_threshold = self.spill_threshold
+        child.shared = dict(self.shared)
+        child.shared_indexes = list(self.shared_indexes)
+        child.offset = dict(self.offset)
+        child.on_disk = self.on_disk
+        if self.temporary_files is not None:
+            child.temporary_files = self.temporary_files
+            self.temporary_files.users += 1
+        if self.index is not None:
+            child.shared_indexes.append((self.index, len(self.index)))
+            child.index = GridIndex(self.index.cell_size)
+        return child
+
+    def build_index(self, cell_size: float):
+        """starts maintaining a spatial index over the items
+
+        Items that were added before are indexed too, but they are not associated
+        to their primitive.
+
+        :param cell_size: the size of the cells of the index, in the output coordinates
+        :type cell_size: float
+        """
+        self.index = GridIndex(cell_size)
+        self.shared_indexes = []
+        for z_index in self.items:
+            for position, (_, bbox) in enumerate(self.stored(z_index)):
+                if bbox is not None:
+                    self.index.insert(bbox, (z_index, position, None))
+
+    def _indexes(self) -> list[tuple[GridIndex, int | None]]:
+        # from the oldest items to the newest
+        return [*self.shared_indexes, (self.index, None)]
+
+    def _at(self, z_index: int, positions: list[int]) -> Iterator[Any]:
+        """yields the items at the given positions (in increasing order),
+        which must all be in memory"""
+        segments = iter([*self.shared.get(z_index, ()), self.items[z_index]])
+        segment = next(segments)
+        start = 0
+        for position in positions:
+            while position >= start + len(segment):
+                start += len(segment)
+                segment = next(segments)
+            yield segment[position - start][0]
+
+    def levels(self, viewport: Rectangle | None = None) -> Iterator[tuple[int, Iterator[Any]]]:
+        """yields the pairs ``(z_index, items)`` by increasing z-index,
+        where ``items`` is an iterator
+
+        :param viewport: if not None, only the items that meet the viewport are given
+        :type viewport: Rectangle
+        """
+        if viewport is None:
+            for z_index in sorted(self.items):
+                yield (z_index, (x for (x, _) in self.stored(z_index)))
+        elif self.index is None or self.on_disk:
+            # the items on disk are read in order, so the index is of no use
+            for z_index in sorted(self.items):
+                yield (
+                    z_index,
+                    (x for (x, bbox) in self.stored(z_index) if bbox is None or bbox.intersects(viewport)),
+                )
+        else:
+            visible = {z_index: list(positions) for (z_index, positions) in self.unbounded.items()}
+            for index, limit in self._indexes():
+                for z_index, position, _ in index.query(viewport, limit):
+                    visible[z_index].append(position)
+            for z_index in sorted(self.items):
+                yield (z_index, self._at(z_index, sorted(visible[z_index])))
+
+    def find(self, rect: Rectangle) -> list[Primitive]:
+        """returns the primitives whose bounding box meets the rectangle
+        (a spatial index must have been built)
+
+        :param rect: the rectangle, in the output coordinates
+        :type rect: Rectangle
+        """
+        found = {}
+        for index, limit in self._indexes():
+            for _, _, primitive in index.query(rect, limit):
+                if primitive is not None:
+                    found[id(primitive)] = primitive
+        return list(found.values())
+
+    def nearest(self, point: Point) -> Primitive | None:
+        """returns the primitive whose bounding box is the nearest to the point
+        (a spatial index must have been built)
+
+        :param point: the point, in the output coordinates
+        :type point: Point
+        """
+        candidates = [index.closest(point, limit) for (index, limit) in self._indexes()]
+        candidates = [candidate for candidate in candidates if candidate is not None]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda candidate: candidate[1])[0][2]
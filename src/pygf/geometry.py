@@ -3,10 +3,21 @@
 # pylint: disable=invalid-name
 from __future__ import annotations
 
-import copy
 import math
+import operator
+from array import array
+from collections.abc import Iterable, Iterator, Mapping
+from types import MappingProxyType
 from typing import Any
 
+try:
+    import numpy as np
+except ImportError:  # numpy is optional
+    np = None
+
+# shared by all undecorated points
+_NO_DECORATION: Mapping[str, Any] = MappingProxyType({})
+
 
 class Point:
     """The famous Point class. Represents a point in 2D.
@@ -18,7 +29,7 @@ class Point:
 
     The point can be *decorated*, with additional attributes. Using the syntax
     `p@dict`, one can add all elements of the dictionary `dict`
-    to the point `p`.
+    to the point `p`. This returns a new point: `p` itself is unchanged.
 
     If `p` is a point, the x and y coordinate can be accessed with
     `p.x` and `p.y`.
@@ -50,13 +61,18 @@ class Point:
         else:
             self.x = fst * math.cos(snd)
             self.y = fst * math.sin(snd)
-        self.dico: dict[str, Any] = {}
+        self.dico: Mapping[str, Any] = _NO_DECORATION
 
     def __matmul__(self, dico: dict[str, Any]) -> Point:
-        x = copy.deepcopy(self)
-        x.dico.update(dico)
+        x = Point(self.x, self.y)
+        x.dico = {**self.dico, **dico}
         return x
 
+    def __reduce__(self):
+        if not self.dico:
+            return (Point, (self.x, self.y))
+        return (operator.matmul, (Point(self.x, self.y), dict(self.dico)))
+
     def get(self, key: str, default: Any = None) -> Any:
         """returns the decoration corresponding to key, like in a
         normal dictionary"""
@@ -78,9 +94,13 @@ class Point:
         return math.atan2(self.y, self.x)
 
     def __add__(self, p: Point) -> Point:
+        if not isinstance(p, Point):
+            return NotImplemented
         return Point(self.x + p.x, self.y + p.y)
 
     def __sub__(self, p: Point) -> Point:
+        if not isinstance(p, Point):
+            return NotImplemented
         return Point(self.x - p.x, self.y - p.y)
 
     def __rmul__(self, m: float) -> Point:
@@ -90,6 +110,8 @@ class Point:
         return Point(m * self.x, m * self.y)
 
     def __or__(self, p: Point) -> Point:
+        if not isinstance(p, Point):
+            return NotImplemented
         return Point(self.x, p.y)
 
     def __format__(self, format_spec: str | None) -> str:
@@ -99,6 +121,163 @@ class Point:
         return self.__format__(None)
 
 
+def _column(values: Iterable[float]):
+    """builds a column of float64, backed by numpy if available"""
+    if np is not None:
+        if not hasattr(values, "__len__"):
+            # generators and iterators
+            return np.fromiter(values, dtype=np.float64)
+        return np.asarray(values, dtype=np.float64)
+    if isinstance(values, array):
+        return values
+    return array("d", values)
+
+
+class PointArray:
+    """A compact array of points, stored as two contiguous columns
+    of float64 (the x-coordinates and the y-coordinates).
+
+    The columns are numpy arrays if numpy is installed, and
+    ``array('d')`` otherwise.
+
+    Can be constructed either by giving the x-coordinates
+    and the y-coordinates, or (if `polar=True`) by giving
+    the radii and the angles (in radians).
+
+    The same operators as for :class:`Point` are defined,
+    and apply to all points at once:
+
+      - Addition and substraction (of a point or of a point array
+        of the same length)
+      - Multiplication by a float
+      - Or-ing (with a point or a point array of the same length)
+
+    Indexing a point array by an integer returns a :class:`Point`,
+    and iterating over it yields points. Points of an array
+    are never decorated.
+
+    :param fst: the x coordinates (if `polar=False`) or the radii (if `polar=True`).
+    :param snd: the y coordinates (if `polar=False`) or the angles (if `polar=True`).
+    :param polar: True if parameters are polar coordinates rather than xy-coordinates.
+
+    """
+
+    __slots__ = ("x", "y")
+
+    # numpy scalars and arrays leave the operators to the point array
+    __array_ufunc__ = None
+
+    def __init__(self, fst: Iterable[float], snd: Iterable[float], *, polar: bool = False):
+        fst = _column(fst)
+        snd = _column(snd)
+        if len(fst) != len(snd):
+            raise ValueError("both columns must have the same length")
+        if polar is False:
+            self.x = fst
+            self.y = snd
+        elif np is not None:
+            self.x = fst * np.cos(snd)
+            self.y = fst * np.sin(snd)
+        else:
+            self.x = array("d", [r * math.cos(t) for (r, t) in zip(fst, snd)])
+            self.y = array("d", [r * math.sin(t) for (r, t) in zip(fst, snd)])
+
+    @classmethod
+    def from_points(cls: type[PointArray], points: Iterable[Point]) -> PointArray:
+        """builds a point array from a list of points
+
+        :param points: the points
+        :type points: Iterable[Point]
+        """
+        if isinstance(points, PointArray):
+            return points
+        points = list(points)
+        return cls([p.x for p in points], [p.y for p in points])
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def __iter__(self) -> Iterator[Point]:
+        for x, y in zip(self.x, self.y):
+            yield Point(float(x), float(y))
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return PointArray(self.x[key], self.y[key])
+        return Point(float(self.x[key]), float(self.y[key]))
+
+    def _binary(self, other, op) -> PointArray:
+        if isinstance(other, Point):
+            (ox, oy) = (other.x, other.y)
+            if np is not None:
+                return PointArray(op(self.x, ox), op(self.y, oy))
+            return PointArray([op(x, ox) for x in self.x], [op(y, oy) for y in self.y])
+        if isinstance(other, PointArray):
+            if len(other) != len(self):
+                raise ValueError("point arrays must have the same length")
+            if np is not None:
+                return PointArray(op(self.x, other.x), op(self.y, other.y))
+            return PointArray(
+                [op(x, ox) for (x, ox) in zip(self.x, other.x)],
+                [op(y, oy) for (y, oy) in zip(self.y, other.y)],
+            )
+        return NotImplemented
+
+    def __add__(self, p: Point | PointArray) -> PointArray:
+        return self._binary(p, lambda u, v: u + v)
+
+    def __radd__(self, p: Point) -> PointArray:
+        return self._binary(p, lambda u, v: v + u)
+
+    def __sub__(self, p: Point | PointArray) -> PointArray:
+        return self._binary(p, lambda u, v: u - v)
+
+    def __rsub__(self, p: Point) -> PointArray:
+        return self._binary(p, lambda u, v: v - u)
+
+    def __mul__(self, m: float) -> PointArray:
+        if np is not None:
+            return PointArray(m * self.x, m * self.y)
+        return PointArray([m * x for x in self.x], [m * y for y in self.y])
+
+    def __rmul__(self, m: float) -> PointArray:
+        return self.__mul__(m)
+
+    def __or__(self, p: Point | PointArray) -> PointArray:
+        if isinstance(p, Point):
+            return PointArray(self.x, [p.y] * len(self))
+        if isinstance(p, PointArray):
+            if len(p) != len(self):
+                raise ValueError("point arrays must have the same length")
+            return PointArray(self.x, p.y)
+        return NotImplemented
+
+    def __ror__(self, p: Point) -> PointArray:
+        if isinstance(p, Point):
+            return PointArray([p.x] * len(self), self.y)
+        return NotImplemented
+
+    def affine(self, a: float, b: float, c: float, d: float, e: float, f: float) -> PointArray:
+        """maps every point (x, y) to (ax+by+e, cx+dy+f)"""
+        if np is not None:
+            return PointArray(a * self.x + b * self.y + e, c * self.x + d * self.y + f)
+        return PointArray(
+            [a * x + b * y + e for (x, y) in zip(self.x, self.y)],
+            [c * x + d * y + f for (x, y) in zip(self.x, self.y)],
+        )
+
+    def bounds(self) -> tuple[float, float, float, float]:
+        """returns the tuple ``(xmin, ymin, xmax, ymax)``"""
+        if len(self) == 0:
+            raise ValueError("empty point array")
+        if np is not None:
+            return (float(self.x.min()), float(self.y.min()), float(self.x.max()), float(self.y.max()))
+        return (float(min(self.x)), float(min(self.y)), float(max(self.x)), float(max(self.y)))
+
+    def __str__(self) -> str:
+        return " ".join(str(p) for p in self)
+
+
 class Rectangle:
     """The famous Rectangle class. The rectangle is aligned with the
     x-axis and the y-axis, and is given by two points.
@@ -140,6 +319,27 @@ class Rectangle:
     def __contains__(self, p: Point) -> bool:
         return self.fst.x <= p.x <= self.snd.x and self.fst.y <= p.y <= self.snd.y
 
+    def intersects(self, other: Rectangle) -> bool:
+        """returns whether the two rectangles have a common point
+
+        :param other: the other rectangle
+        :type other: Rectangle
+        """
+        return (
+            self.fst.x <= other.snd.x
+            and other.fst.x <= self.snd.x
+            and self.fst.y <= other.snd.y
+            and other.fst.y <= self.snd.y
+        )
+
+    def enlarge(self, margin: float) -> Rectangle:
+        """returns the rectangle enlarged by the margin on each side
+
+        :param margin: the margin
+        :type margin: float
+        """
+        return Rectangle(self.fst - Point(margin, margin), self.snd + Point(margin, margin))
+
     @property
     def center(self) -> Point:
         """returns the center of the rectangle
@@ -216,15 +416,18 @@ class Rectangle:
         return Point(self.snd.x, self.fst.y)
 
     @classmethod
-    def bounding_box(cls: type[Rectangle], point_list: list[Point]) -> Rectangle:
+    def bounding_box(cls: type[Rectangle], point_list: list[Point] | PointArray) -> Rectangle:
         """returns the smallest rectangle that contains all points
         in the list.
 
         :param point_list: The list of points
-        :type point_list: List[Point]
+        :type point_list: List[Point] or PointArray
 
         :rtype: Rectangle
         """
+        if isinstance(point_list, PointArray):
+            (x0, y0, x1, y1) = point_list.bounds()
+            return cls(Point(x0, y0), Point(x1, y1))
         x0 = min(p.x for p in point_list)
         x1 = max(p.x for p in point_list)
         y0 = min(p.y for p in point_list)
@@ -321,7 +524,7 @@ class Transform:
     Three operators are defined on Transform objects:
       - one can multiply them together (using the * operator)
       - one can inverse a transform (using the inverse function)
-      - one can apply the transform to a point
+      - one can apply the transform to a point (or to a point array)
 
     """
 
@@ -345,14 +548,52 @@ class Transform:
         self.e = e
         self.f = f
 
-    def __call__(self, point: Point) -> Point:
-        """transforms a point"""
+    def __call__(self, point: Point | PointArray) -> Point | PointArray:
+        """transforms a point (or all points of a point array)"""
+
+        if isinstance(point, PointArray):
+            return point.affine(self.a, self.b, self.c, self.d, self.e, self.f)
 
         x = self.a * point.x + self.b * point.y + self.e
         y = self.c * point.x + self.d * point.y + self.f
 
         return Point(x, y)
 
+    def apply_many(self, points: Iterable[Point] | PointArray) -> list[Point] | PointArray:
+        """transforms all points of a sequence in one pass
+
+        Returns a point array if given a point array, and a list of points otherwise.
+        The identity and the translations are detected and take a faster path.
+
+        :param points: the points to transform
+        :type points: Iterable[Point] or PointArray
+        """
+        if isinstance(points, PointArray):
+            if self.is_identity:
+                return points
+            if self.is_translation:
+                return points + Point(self.e, self.f)
+            return points.affine(self.a, self.b, self.c, self.d, self.e, self.f)
+
+        if self.is_identity:
+            return list(points)
+        (a, b, c, d, e, f) = (self.a, self.b, self.c, self.d, self.e, self.f)
+        if self.is_translation:
+            return [Point(p.x + e, p.y + f) for p in points]
+        return [Point(a * p.x + b * p.y + e, c * p.x + d * p.y + f) for p in points]
+
+    @property
+    def is_translation(self) -> bool:
+        """returns whether the transform is a translation (possibly the identity)"""
+
+        return self.a == 1 and self.b == 0 and self.c == 0 and self.d == 1
+
+    @property
+    def is_identity(self) -> bool:
+        """returns whether the transform is the identity"""
+
+        return self.is_translation and self.e == 0 and self.f == 0
+
     def __mul__(self, other: Transform) -> Transform:
         """composes two transforms"""
 
@@ -420,3 +661,138 @@ class Transform:
 
         """
         return cls(a=x, d=y)
+
+
+class GridIndex:
+    """A spatial index over rectangles, given by a uniform grid.
+
+    Each rectangle is associated with a value, and one can ask for the values
+    of the rectangles that meet a given rectangle, or for the value
+    of the rectangle nearest to a given point.
+
+    :param cell_size: the size of the cells of the grid
+    :type cell_size: float
+
+    Rectangles that span too many cells are kept aside,
+    and are tested at each query.
+    """
+
+    # maximal number of cells a rectangle can span
+    max_cells = 64
+
+    def __init__(self, cell_size: float):
+        self.cell_size = cell_size
+        self.cells: dict[tuple[int, int], list[int]] = {}
+        self.boxes: list[Rectangle] = []
+        self.values: list[Any] = []
+        self.large: list[int] = []
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+    def _cell_range(self, rect: Rectangle) -> tuple[int, int, int, int]:
+        cs = self.cell_size
+        return (
+            math.floor(rect.fst.x / cs),
+            math.floor(rect.fst.y / cs),
+            math.floor(rect.snd.x / cs),
+            math.floor(rect.snd.y / cs),
+        )
+
+    def insert(self, rect: Rectangle, value: Any):
+        """adds a rectangle to the index
+
+        :param rect: the rectangle
+        :type rect: Rectangle
+        :param value: the value associated to the rectangle
+        """
+        n = len(self.boxes)
+        self.boxes.append(rect)
+        self.values.append(value)
+        (i0, j0, i1, j1) = self._cell_range(rect)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > self.max_cells:
+            self.large.append(n)
+            return
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                self.cells.setdefault((i, j), []).append(n)
+
+    def query(self, rect: Rectangle, limit: int | None = None) -> list[Any]:
+        """returns the values of all rectangles that meet the rectangle, in the order
+        they were inserted
+
+        :param rect: the rectangle
+        :type rect: Rectangle
+        :param limit: if not None, only the first ``limit`` rectangles inserted are considered
+        :type limit: int
+        """
+        boxes = self.boxes
+        limit = len(boxes) if limit is None else limit
+        found = {n for n in self.large if n < limit and boxes[n].intersects(rect)}
+        (i0, j0, i1, j1) = self._cell_range(rect)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self.cells):
+            cells = [cell for ((i, j), cell) in self.cells.items() if i0 <= i <= i1 and j0 <= j <= j1]
+        else:
+            cells = [self.cells.get((i, j), ()) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)]
+        for cell in cells:
+            found.update(n for n in cell if n < limit and n not in found and boxes[n].intersects(rect))
+        return [self.values[n] for n in sorted(found)]
+
+    def nearest(self, point: Point) -> Any:
+        """returns the value of the rectangle nearest to the point
+        (None if the index is empty)
+
+        :param point: the point
+        :type point: Point
+        """
+        closest = self.closest(point)
+        return None if closest is None else closest[0]
+
+    def closest(self, point: Point, limit: int | None = None) -> tuple[Any, float] | None:
+        """returns the value of the rectangle nearest to the point, and its distance to the point
+        (None if the index is empty)
+
+        :param point: the point
+        :type point: Point
+        :param limit: if not None, only the first ``limit`` rectangles inserted are considered
+        :type limit: int
+        """
+        limit = len(self.boxes) if limit is None else limit
+
+        def distance(n):
+            box = self.boxes[n]
+            dx = max(box.fst.x - point.x, 0, point.x - box.snd.x)
+            dy = max(box.fst.y - point.y, 0, point.y - box.snd.y)
+            return math.hypot(dx, dy)
+
+        best = min((n for n in self.large if n < limit), key=distance, default=None)
+        best_distance = math.inf if best is None else distance(best)
+        if not self.cells:
+            return None if best is None else (self.values[best], best_distance)
+
+        cs = self.cell_size
+        (pi, pj) = (math.floor(point.x / cs), math.floor(point.y / cs))
+        # the rings around the cell of the point that need to be visited to see all cells
+        last_ring = max(max(abs(i - pi), abs(j - pj)) for (i, j) in self.cells)
+        for r in range(last_ring + 1):
+            if best_distance <= (r - 1) * cs:
+                # all cells at distance r are too far
+                break
+            if 8 * r > len(self.cells):
+                # cheaper to look at all remaining cells at once
+                ring = [(i, j) for (i, j) in self.cells if max(abs(i - pi), abs(j - pj)) >= r]
+            elif r == 0:
+                ring = [(pi, pj)]
+            else:
+                ring = [(i, j) for i in range(pi - r, pi + r + 1) for j in (pj - r, pj + r)]
+                ring += [(i, j) for i in (pi - r, pi + r) for j in range(pj - r + 1, pj + r)]
+            for cell in ring:
+                for n in self.cells.get(cell, ()):
+                    if n >= limit:
+                        continue
+                    d = distance(n)
+                    if d < best_distance or (d == best_distance and n < best):
+                        (best, best_distance) = (n, d)
+            if 8 * r > len(self.cells):
+                break
+        return None if best is None else (self.values[best], best_distance)
@@ -3,18 +3,30 @@
 # pylint: disable=invalid-name
 from __future__ import annotations
 
+import copy
+import io
 import math
+import numbers
+import sys
 from abc import ABC, abstractmethod
 from collections.abc import Sequence
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager
+from itertools import repeat
 from typing import IO
 
-from pygf.geometry import Point, Rectangle, Transform
+from pygf.display import Primitive, resolve_style, style_key
+from pygf.geometry import Point, PointArray, Rectangle, Transform
 
 
 class Layer(ABC):
     """Layer is the abstract class that represents a graphics system.
     All relevant classes are subclasses of this one.
 
+    The drawing commands do not depend on the graphics system: they
+    resolve the geometry and the style into a :class:`pygf.display.Primitive`,
+    and pass it to :meth:`add_primitive`, which is what subclasses implement.
+
     :param transform: the general transform to apply to the layer
     :type transform: Transform
 
@@ -24,8 +36,114 @@ class Layer(ABC):
         if transform is None:
             transform = Transform()
         self.transform = transform
+        self._last_bounding_box = (None, None, None)
+
+    @property
+    def transform(self) -> Transform:
+        """the general transform to apply to the layer"""
+        return self._transform
+
+    @transform.setter
+    def transform(self, transform: Transform):
+        self._transform = transform
+        self._fused_transform = None
+        self._inverse_fused_transform = None
+
+    @property
+    def fused_transform(self) -> Transform:
+        """the transform from the user coordinates to the output coordinates
+
+        It is computed once and cached until ``transform`` is reassigned.
+        """
+        if self._fused_transform is None:
+            self._fused_transform = self._fuse_transform()
+        return self._fused_transform
+
+    def _fuse_transform(self) -> Transform:
+        """computes the fused transform (helper for fused_transform)"""
+        return self.transform
+
+    @property
+    def inverse_fused_transform(self) -> Transform:
+        """the transform from the output coordinates to the user coordinates
+
+        It is computed when needed, and cached as the fused transform.
+        """
+        if self._inverse_fused_transform is None:
+            self._inverse_fused_transform = self.fused_transform.inverse
+        return self._inverse_fused_transform
+
+    @contextmanager
+    def scope(self, transform: Transform, *, native: bool = False, z_index: int = 1):
+        """Draw in another frame
+
+        :param transform: the transform from the coordinates of the scope to the current coordinates
+        :type transform: Transform
+        :param native: whether the scope is written as such in the output, if the layer supports it
+        :type native: bool
+        :param z_index: z-index of the scope, if native (1 by default)
+        :type z_index: int
+
+        Yields the layer to draw on. Unless the scope is native, this is the layer itself,
+        whose transform is composed with the transform of the scope.
+        A native scope yields a :class:`DisplayList`: when the scope is closed,
+        what was drawn on it is added to the layer as a whole, at the given z-index,
+        as a group with a transform (``<g transform>`` in SVG, ``scope`` in TikZ).
+        """
+        if native:
+            recorded = DisplayList()
+            yield recorded
+            self._place("scope", recorded, transform, z_index)
+            return
+        # the transforms of the enclosing frame are kept, rather than computed again
+        saved = (self._transform, self._fused_transform, self._inverse_fused_transform)
+        self.transform = self._transform * transform
+        try:
+            yield self
+        finally:
+            (self._transform, self._fused_transform, self._inverse_fused_transform) = saved
+
+    def fork(self) -> Layer:
+        """returns a new layer which contains everything drawn so far on this layer
+
+        What is drawn afterwards on one of the layers does not appear on the other.
+        Whenever possible, the output recorded so far is shared by both layers rather than copied.
+        """
+        return copy.copy(self)
+
+    def bounding_box(self, primitive: Primitive) -> Rectangle | None:
+        """returns the bounding box of a primitive in the output coordinates
+        (None if the primitive should always be drawn)
+
+        :param primitive: the primitive
+        :type primitive: Primitive
+        """
+        (last_primitive, last_transform, last_box) = self._last_bounding_box
+        tf = self.fused_transform
+        if primitive is last_primitive and tf is last_transform:
+            # a primitive usually gives several items
+            return last_box
+        box = primitive.bounding_box
+        if primitive.kind == "picture":
+            # the picture is centered on its position, with its own size
+            center = tf(primitive.points[0])
+            corner = self.picture_size(primitive) * 0.5
+            box = Rectangle(center - corner, center + corner)
+        elif box is not None:
+            box = Rectangle.bounding_box(
+                tf.apply_many([box.northwest, box.northeast, box.southeast, box.southwest])
+            )
+        self._last_bounding_box = (primitive, tf, box)
+        return box
+
+    def picture_size(self, primitive: Primitive) -> Point:
+        """returns the size (width, height) of a picture in the output coordinates
+
+        :param primitive: the picture
+        :type primitive: Primitive
+        """
+        return Point(primitive.width, primitive.height)
 
-    @abstractmethod
     def line(self, p1: Point, p2: Point, labels: dict | None = None, *, z_index: int = 0, **style):
         """Draw a line from one point to the other (edge command)
 
@@ -41,8 +159,8 @@ class Layer(ABC):
         :type style: dict
 
         """
+        self.add_primitive(Primitive.build("line", [p1, p2], style, labels, z_index))
 
-    @abstractmethod
     def text(self, point: Point, text: str, *, z_index: int = 1, **style):
         """Place a text at a given point (shape command)
 
@@ -59,8 +177,8 @@ class Layer(ABC):
         itself is not: it will always appear horizontally and will not be
         stretched.
         """
+        self.add_primitive(Primitive.build("text", [point], style, z_index=z_index, text=str(text)))
 
-    @abstractmethod
     def rectangle(self, p1: Point, p2: Point, *, z_index: int = 1, **style):
         """Draws a rectangle whose corners are the two given points (shape command)
 
@@ -77,11 +195,20 @@ class Layer(ABC):
         specifies that everything is rotated, then the rectangle will
         be rotated as well.
         """
+        r = Rectangle(p1, p2)
+        self.add_primitive(
+            Primitive.build(
+                "rectangle",
+                [r.southwest, r.southeast, r.northeast, r.northwest],
+                style,
+                z_index=z_index,
+                closed=True,
+            )
+        )
 
-    @abstractmethod
     def polyline(
         self,
-        points: list[Point],
+        points: list[Point] | PointArray,
         labels: dict | None = None,
         *,
         z_index: int = 0,
@@ -91,7 +218,7 @@ class Layer(ABC):
         """Draw line segments from one point to the next (edge command)
 
         :param points: list of points
-        :type points: list[Point]
+        :type points: list[Point] or PointArray
         :param labels: possible labels to put on the lines
         :type labels: dict
         :param z_index: z-index of the path (0 by default)
@@ -116,15 +243,19 @@ class Layer(ABC):
         In general, it is therefore best to use ``closed = True`` for
         closed polylines.
         """
+        if not isinstance(points, PointArray):
+            points = list(points)
+        self.add_primitive(Primitive.build("polyline", points, style, labels, z_index, closed))
 
-    def polygon(self, points: list[Point], labels: dict | None = None, *, z_index: int = 1, **style):
+    def polygon(
+        self, points: list[Point] | PointArray, labels: dict | None = None, *, z_index: int = 1, **style
+    ):
         """Draw a polygon (shape command)
 
         Alias for ``polyline(..., closed = True)`` with default ``z_index`` of 1
         """
         self.polyline(points, labels, closed=True, z_index=z_index, **style)
 
-    @abstractmethod
     def circle(self, p1: Point, radius: float, labels: dict | None = None, *, z_index: int = 1, **style):
         """Draws a circle given a point and a radius (shape command)
 
@@ -144,11 +275,11 @@ class Layer(ABC):
         for the x-axis and the y-axis.
 
         """
+        self.add_primitive(Primitive.build("circle", [p1], style, labels, z_index, radius=radius))
 
-    @abstractmethod
     def edge(
         self,
-        points: list[Point],
+        points: list[Point] | PointArray,
         labels: dict | None = None,
         *,
         closed: bool = False,
@@ -158,7 +289,7 @@ class Layer(ABC):
         """Draw a curve passing through the points (edge command)
 
         :param points: list of points
-        :type points: list[Point]
+        :type points: list[Point] or PointArray
         :param labels: possible labels to put on the lines
         :type labels: dict
         :param z_index: z-index of the path (0 by default)
@@ -172,8 +303,18 @@ class Layer(ABC):
         The points might be decorated to specify at which angle the curve
         should pass through the point.
         """
-
-    def shape(self, points: list[Point], labels: dict | None = None, *, z_index: int = 1, **style):
+        points = list(points)
+        angles = self.find_angles(points, closed=closed)
+        if closed:
+            points.append(points[0])
+            angles.append(angles[0])
+        self.add_primitive(
+            Primitive.build("edge", points, style, labels, z_index, closed, angles=angles)
+        )
+
+    def shape(
+        self, points: list[Point] | PointArray, labels: dict | None = None, *, z_index: int = 1, **style
+    ):
         """Draw a shape passing through the points (shape command)
 
         Alias for ``edge(..., closed = True)`` with ``z_index`` of 1 by default.
@@ -181,7 +322,6 @@ class Layer(ABC):
         """
         self.edge(points, labels, z_index=z_index, closed=True, **style)
 
-    @abstractmethod
     def picture(self, point: Point, img_name: str, width: float, height: float, *, z_index: int = 1):
         """Draw an image (shape command)
 
@@ -196,9 +336,230 @@ class Layer(ABC):
         :param z_index: z-index of the path (1 by default)
         :type z_index: int
         """
+        self.add_primitive(
+            Primitive("picture", [point], {}, z_index=z_index, img_name=img_name, width=width, height=height)
+        )
+
+    def place(self, template: DisplayList, transform: Transform | None = None, *, z_index: int = 1):
+        """Draw an instance of a template (shape command)
+
+        The template is drawn once in the output, and each instance refers to it
+        (if the layer supports it).
+
+        :param template: what is drawn by the template, in its own coordinates
+        :type template: DisplayList
+        :param transform: the transform from the coordinates of the template
+            to the coordinates of the layer (usually a translation and a rotation)
+        :type transform: Transform
+        :param z_index: z-index of the instance (1 by default)
+        :type z_index: int
+
+        The whole instance is at the same z-index: inside it, the primitives of the template
+        are ordered by their own z-index.
+        """
+        if transform is None:
+            transform = Transform()
+        self._place("instance", template, transform, z_index)
+
+    def _place(self, kind: str, template: DisplayList, transform: Transform, z_index: int):
+        """adds the primitive that draws the template with the transform"""
+        box = template.extent()
+        if box is None:
+            if template.bounded():
+                return
+            # only texts and pictures: the instance is always drawn, from its position
+            box = Rectangle(Point(0, 0), Point(0, 0))
+        points = transform.apply_many([box.northwest, box.northeast, box.southeast, box.southwest])
+        self.add_primitive(
+            Primitive(kind, points, {}, z_index=z_index, template=template, transform=transform)
+        )
+
+    def _add_transformed(self, primitive: Primitive, resolved):
+        """draws a non native scope recorded by a display list"""
+        self._replay_instance(primitive)
+
+    def _replay_instance(self, primitive: Primitive):
+        """draws an instance by drawing again all primitives of its template"""
+        old = self.transform
+        self.transform = old * primitive.transform
+        try:
+            primitive.template.replay(self)
+        finally:
+            self.transform = old
+
+    def lines(
+        self,
+        starts: Sequence[Point] | PointArray,
+        ends: Sequence[Point] | PointArray,
+        labels: Sequence[dict | None] | None = None,
+        *,
+        z_index: int = 0,
+        **style,
+    ):
+        """Draw a line from each point of ``starts`` to the corresponding point of ``ends`` (edge command)
+
+        :param starts: the first points
+        :type starts: list[Point] or PointArray
+        :param ends: the second points
+        :type ends: list[Point] or PointArray
+        :param labels: for each line, the dictionary of labels to put on the line (or None)
+        :type labels: list[dict]
+        :param z_index: z-index of the paths (0 by default)
+        :type z_index: int
+        :param style: additional styling elements, common to all lines
+        :type style: dict
+
+        This is equivalent to calling :meth:`line` for each line, but
+        the style is only resolved once.
+        """
+        _check_lengths(starts=starts, ends=ends, labels=labels)
+        key = style_key(style)
+        resolved = resolve_style(style, key)
+        labels = repeat(None) if labels is None else labels
+        self.add_primitives(
+            [
+                Primitive("line", [p1, p2], resolved, label, z_index, style_key=key)
+                for (p1, p2, label) in zip(starts, ends, labels)
+            ]
+        )
+
+    def circles(
+        self,
+        centers: Sequence[Point] | PointArray,
+        radii: float | Sequence[float],
+        labels: Sequence[dict | None] | None = None,
+        *,
+        z_index: int = 1,
+        **style,
+    ):
+        """Draw circles (shape command)
+
+        :param centers: the centers of the circles
+        :type centers: list[Point] or PointArray
+        :param radii: the radius of each circle, or one radius for all circles
+        :type radii: float or list[float]
+        :param labels: for each circle, the dictionary of labels to put on the circle (or None)
+        :type labels: list[dict]
+        :param z_index: z-index of the paths (1 by default)
+        :type z_index: int
+        :param style: additional styling elements, common to all circles
+        :type style: dict
+
+        This is equivalent to calling :meth:`circle` for each circle, but
+        the style is only resolved once.
+        """
+        single = isinstance(radii, numbers.Real)
+        _check_lengths(centers=centers, radii=None if single else radii, labels=labels)
+        key = style_key(style)
+        resolved = resolve_style(style, key)
+        radii = repeat(radii) if single else radii
+        labels = repeat(None) if labels is None else labels
+        self.add_primitives(
+            [
+                Primitive("circle", [p1], resolved, label, z_index, radius=radius, style_key=key)
+                for (p1, radius, label) in zip(centers, radii, labels)
+            ]
+        )
+
+    def texts(self, points: Sequence[Point] | PointArray, texts: Sequence[str], *, z_index: int = 1, **style):
+        """Place texts at the given points (shape command)
+
+        :param points: the points where the texts will be placed
+        :type points: list[Point] or PointArray
+        :param texts: the texts
+        :type texts: list[str]
+        :param z_index: z-index of the texts (1 by default)
+        :type z_index: int
+        :param style: additional styling elements, common to all texts
+        :type style: dict
+
+        This is equivalent to calling :meth:`text` for each text, but
+        the style is only resolved once.
+        """
+        _check_lengths(points=points, texts=texts)
+        key = style_key(style)
+        resolved = resolve_style(style, key)
+        self.add_primitives(
+            [
+                Primitive("text", [point], resolved, z_index=z_index, text=str(text), style_key=key)
+                for (point, text) in zip(points, texts)
+            ]
+        )
+
+    def polylines(
+        self,
+        point_lists: Sequence[Sequence[Point] | PointArray],
+        labels: Sequence[dict | None] | None = None,
+        *,
+        z_index: int = 0,
+        closed: bool = False,
+        **style,
+    ):
+        """Draw several polylines (edge command)
+
+        :param point_lists: for each polyline, its list of points
+        :type point_lists: list[list[Point]] or list[PointArray]
+        :param labels: for each polyline, the dictionary of labels to put on the lines (or None)
+        :type labels: list[dict]
+        :param z_index: z-index of the paths (0 by default)
+        :type z_index: int
+        :param closed: If true, each polyline is closed
+        :type closed: bool
+        :param style: additional styling elements, common to all polylines
+        :type style: dict
+
+        This is equivalent to calling :meth:`polyline` for each polyline, but
+        the style is only resolved once.
+        """
+        _check_lengths(point_lists=point_lists, labels=labels)
+        key = style_key(style)
+        resolved = resolve_style(style, key)
+        labels = repeat(None) if labels is None else labels
+        self.add_primitives(
+            [
+                Primitive(
+                    "polyline",
+                    points if isinstance(points, PointArray) else list(points),
+                    resolved,
+                    label,
+                    z_index,
+                    closed,
+                    style_key=key,
+                )
+                for (points, label) in zip(point_lists, labels)
+            ]
+        )
 
     @abstractmethod
-    def draw(self, rect: Rectangle, fs: IO | None = None, options=None, *, preamble: bool = False):
+    def add_primitive(self, primitive: Primitive):
+        """Draw a primitive. This is where the drawing commands end up.
+
+        :param primitive: the primitive
+        :type primitive: Primitive
+        """
+
+    def add_primitives(self, primitives: list[Primitive]):
+        """Draw several primitives, of the same kind and with the same style.
+        This is where the bulk drawing commands end up.
+
+        Subclasses may override it to resolve the style only once.
+
+        :param primitives: the primitives
+        :type primitives: list[Primitive]
+        """
+        for primitive in primitives:
+            self.add_primitive(primitive)
+
+    @abstractmethod
+    def draw(
+        self,
+        rect: Rectangle,
+        fs: IO | None = None,
+        options=None,
+        *,
+        preamble: bool = False,
+        cull: bool = True,
+    ):
         """Write the result in a file
 
         :param rect: The bounding box for the picture
@@ -207,7 +568,15 @@ class Layer(ABC):
         :type fs: IO
         :param preamble: whether to produce a standalone file, or a file to be included in another
         :type preamble: bool
+        :param cull: whether to skip the primitives that are outside of the bounding box
+        :type cull: bool
+
+        A primitive is only skipped if its bounding box is far enough from
+        the bounding box of the picture (see ``cull_margin``), since the strokes
+        and the labels may go beyond it. Texts, whose size is not known, are always drawn.
 
+        If the output of the layer was spilled to temporary files, they are removed
+        once the layer is drawn, and the layer cannot be drawn again.
         """
 
     def find_angles(self, points: list[Point], *, closed: bool = False):
@@ -258,29 +627,73 @@ class NoLayer(Layer):
     def __init__(self, transform=None):
         Layer.__init__(self, transform)
 
-    def line(self, p1, p2, labels=None, *, z_index=0, **style):
+    def add_primitive(self, primitive):
         pass
 
-    def text(self, point, text, *, z_index=1, **style):
+    def add_primitives(self, primitives):
         pass
 
-    def rectangle(self, p1, p2, *, z_index=1, **style):
+    def draw(self, rect, fs=None, options=None, *, preamble=False, cull=True):
         pass
 
-    def circle(self, p1, radius, labels=None, *, z_index=1, **style):
-        pass
 
-    def picture(self, point, img_name, width, height, *, z_index=1):
-        pass
+class DisplayList(Layer):
+    """Layer that only records the primitives it receives.
 
-    def draw(self, rect, fs=None, options=None, *, preamble=False):
-        pass
+    The recorded primitives can be replayed into any other layer afterwards:
+    the geometry is computed once, whatever the number of layers that draw it.
 
-    def polyline(self, points, labels=None, *, closed=False, z_index=0, **style):
-        pass
+    The draw method is nonimplemented.
 
-    def edge(self, points, labels=None, *, closed=False, z_index=0, **style):
-        pass
+    """
+
+    def __init__(self):
+        Layer.__init__(self, None)
+        self.primitives: list[Primitive] = []
+
+    def add_primitive(self, primitive):
+        self.primitives.append(primitive)
+
+    def add_primitives(self, primitives):
+        self.primitives.extend(primitives)
+
+    def fork(self):
+        child = copy.copy(self)
+        child.primitives = list(self.primitives)
+        return child
+
+    @contextmanager
+    def scope(self, transform, *, native=False, z_index=1):
+        # the primitives are recorded in the user coordinates, so the scope is recorded as a whole
+        recorded = DisplayList()
+        yield recorded
+        self._place("scope" if native else "transformed", recorded, transform, z_index)
+
+    def extent(self) -> Rectangle | None:
+        """returns the bounding box of the recorded primitives that have one
+        (None if there are none)"""
+        boxes = [primitive.bounding_box for primitive in self.primitives]
+        boxes = [box for box in boxes if box is not None]
+        if not boxes:
+            return None
+        return Rectangle.bounding_box([point for box in boxes for point in (box.fst, box.snd)])
+
+    def bounded(self) -> bool:
+        """whether all the recorded primitives have a bounding box
+        (otherwise, the instances of the display list are always drawn)"""
+        return all(primitive.bounding_box is not None for primitive in self.primitives)
+
+    def replay(self, layer: Layer):
+        """Send all recorded primitives to another layer
+
+        :param layer: the layer
+        :type layer: Layer
+        """
+        for primitive in self.primitives:
+            layer.add_primitive(primitive)
+
+    def draw(self, rect, fs=None, options=None, *, preamble=False, cull=True):
+        raise NotImplementedError
 
 
 class MultiLayer(Layer):
@@ -292,44 +705,53 @@ class MultiLayer(Layer):
 
     The draw method is nonimplemented. Instead, the draw_all function is provided, that takes into account the different layers.
 
+    Each drawing command is resolved once, and the resulting primitive is shared by all the layers.
+
     """
 
     def __init__(self, layers):
         Layer.__init__(self, None)
         self.layers = layers
 
-    def line(self, p1, p2, labels=None, *, z_index=0, **style):
-        for layer in self.layers:
-            layer.line(p1, p2, labels, z_index=z_index, **style)
-
-    def text(self, point, text, *, z_index=1, **style):
-        for layer in self.layers:
-            layer.text(point, text, z_index=z_index, **style)
-
-    def rectangle(self, p1, p2, *, z_index=1, **style):
+    def add_primitive(self, primitive):
         for layer in self.layers:
-            layer.rectangle(p1, p2, z_index=z_index, **style)
+            layer.add_primitive(primitive)
 
-    def circle(self, p1, radius, labels=None, *, z_index=1, **style):
+    def add_primitives(self, primitives):
         for layer in self.layers:
-            layer.circle(p1, radius, labels, z_index=z_index, **style)
-
-    def edge(self, points, labels=None, *, closed=False, z_index=0, **style):
-        for layer in self.layers:
-            layer.edge(points, labels=labels, closed=closed, z_index=z_index, **style)
-
-    def polyline(self, points, labels=None, *, closed=False, z_index=0, **style):
-        for layer in self.layers:
-            layer.polyline(points, labels, z_index=z_index, closed=closed, **style)
-
-    def picture(self, point, img_name, width, height, *, z_index=1):
-        for layer in self.layers:
-            layer.picture(point, img_name, width, height, z_index=z_index)
+            layer.add_primitives(primitives)
+
+    def fork(self):
+        child = copy.copy(self)
+        child.layers = [layer.fork() for layer in self.layers]
+        return child
+
+    @contextmanager
+    def scope(self, transform, *, native=False, z_index=1):
+        if native:
+            with Layer.scope(self, transform, native=True, z_index=z_index) as recorded:
+                yield recorded
+            return
+        # the transform of a multilayer is not used: the scope applies to each layer
+        with ExitStack() as stack:
+            for layer in self.layers:
+                stack.enter_context(layer.scope(transform))
+            yield self
 
-    def draw(self, rect, fs=None, options=None, *, preamble=False):
+    def draw(self, rect, fs=None, options=None, *, preamble=False, cull=True):
         raise NotImplementedError
 
-    def draw_all(self, rect: Rectangle, fs: Sequence[IO] | None = None, options=None, *, preamble=False):
+    def draw_all(
+        self,
+        rect: Rectangle,
+        fs: Sequence[IO] | None = None,
+        options=None,
+        *,
+        preamble=False,
+        cull=True,
+        workers: int | None = None,
+        executor: Executor | None = None,
+    ):
         """Write the result to a list of files
 
         :param rect: The bounding box for the picture
@@ -338,12 +760,49 @@ class MultiLayer(Layer):
         :type fs: list[IO]
         :param preamble: whether to produce standalone files, or files to be included in another
         :type preamble: bool
-
+        :param cull: whether to skip the primitives that are outside of the bounding box
+        :type cull: bool
+        :param workers: if not None, the layers are drawn in parallel by this number of processes
+        :type workers: int
+        :param executor: if not None, the layers are drawn in parallel by this executor
+        :type executor: concurrent.futures.Executor
+
+        To be drawn in parallel, the layers must be picklable
+        (in particular, their buffers must not be spilled to disk).
+        The output is the same as when the layers are drawn one after the other.
         """
 
-        if fs is not None:
-            for layer, f in zip(self.layers, fs):
-                layer.draw(rect, f, options, preamble=preamble)
-        else:
-            for layer in self.layers:
-                layer.draw(rect, None, options, preamble=preamble)
+        if workers is None and executor is None:
+            if fs is not None:
+                for layer, f in zip(self.layers, fs):
+                    layer.draw(rect, f, options, preamble=preamble, cull=cull)
+            else:
+                for layer in self.layers:
+                    layer.draw(rect, None, options, preamble=preamble, cull=cull)
+            return
+
+        with ExitStack() as stack:
+            if executor is None:
+                executor = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+            futures = [
+                executor.submit(_draw_to_string, layer, rect, options, preamble, cull)
+                for layer in self.layers
+            ]
+            if fs is None:
+                fs = repeat(sys.stdout)
+            for future, f in zip(futures, fs):
+                f.write(future.result())
+
+
+def _draw_to_string(layer: Layer, rect: Rectangle, options, preamble: bool, cull: bool) -> str:
+    """draws a layer in a string, in a worker process"""
+    f = io.StringIO()
+    layer.draw(rect, f, options, preamble=preamble, cull=cull)
+    return f.getvalue()
+
+
+def _check_lengths(**sequences):
+    """raises a ValueError if the sequences (None for a missing one) have different lengths"""
+    lengths = {name: len(sequence) for (name, sequence) in sequences.items() if sequence is not None}
+    if len(set(lengths.values())) > 1:
+        raise ValueError(f"{' and '.join(lengths)} must have the same length")
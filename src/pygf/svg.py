@@ -2,13 +2,42 @@
 
 # pylint: disable=invalid-name
 import base64
+import copy
+import hashlib
 import math
+import mimetypes
+import os
+import re
+import sys
 import xml.etree.ElementTree as ET
-from dataclasses import dataclass
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
 
+from pygf.display import ZBuffer, style_cache
 from pygf.geometry import Point, Rectangle, Transform
 from pygf.layer import Layer
-from pygf import params
+
+# the attributes that can be moved to a CSS class
+CSS_PROPERTIES = frozenset(
+    [
+        "stroke",
+        "stroke-width",
+        "stroke-opacity",
+        "stroke-dasharray",
+        "stroke-linecap",
+        "stroke-linejoin",
+        "fill",
+        "fill-opacity",
+        "opacity",
+        "font-family",
+        "font-size",
+        "font-style",
+        "font-weight",
+        "text-anchor",
+        "dominant-baseline",
+    ]
+)
 
 
 @dataclass
@@ -39,12 +68,9 @@ class PathElement:
 class SVGLine(PathElement):
     """A line element in a SVG Path"""
 
-    def __str__(self, first=None):
-        s = ""
-        if first:
-            s = "M {self.first_point}"
-        s += f" L {self.next_point}"
-        return s
+    def encode(self, encoder):
+        """writes the element with the encoder"""
+        encoder.line_to(self.next_point)
 
     def reverse(self):
         return SVGLine(self.next_point, self.first_point)
@@ -60,15 +86,14 @@ class SVGEllipse(PathElement):
     large_flag: int
     sweep_flag: int
 
-    def __str__(self, first=None):
-        s = ""
-        if first:
-            s = "M {self.first_point}"
-        s += (
-            f" A {self.rx} {self.ry} {self.x_axis_rotation}"
-            f" {self.large_flag} {self.sweep_flag} {self.next_point}"
+    def encode(self, encoder):
+        """writes the element with the encoder"""
+        encoder.segment(
+            "A",
+            [self.next_point],
+            f"{encoder.number(self.rx)} {encoder.number(self.ry)} {encoder.number(self.x_axis_rotation)}"
+            f" {self.large_flag} {self.sweep_flag} ",
         )
-        return s
 
     def reverse(self):
         return SVGEllipse(
@@ -92,12 +117,9 @@ class SVGBezier(PathElement):
     first_control_point: Point
     second_control_point: Point
 
-    def __str__(self, first=None):
-        s = ""
-        if first:
-            s = "M {self.first_point}"
-        s += f" C {self.first_control_point} {self.second_control_point} {self.next_point}"
-        return s
+    def encode(self, encoder):
+        """writes the element with the encoder"""
+        encoder.segment("C", [self.first_control_point, self.second_control_point, self.next_point])
 
     def reverse(self):
         return SVGBezier(
@@ -114,35 +136,121 @@ class SVGQuadratic(PathElement):
 
     control_point: Point
 
-    def __str__(self, first=None):
-        s = ""
-        if first:
-            s = "M {self.first_point}"
-        s += f" Q {self.control_point} {self.next_point}"
-        return s
+    def encode(self, encoder):
+        """writes the element with the encoder"""
+        encoder.segment("Q", [self.control_point, self.next_point])
 
     def reverse(self):
         return SVGQuadratic(self.next_point, self.first_point, self.control_point)
 
 
+class PathEncoder:
+    """Writes the data of a SVG path as compactly as possible.
+
+    Each command is written with absolute or relative coordinates, whichever is shorter.
+    The coordinates are rounded to ``precision`` decimals, and relative coordinates are
+    computed between rounded positions, so that the rounding errors do not accumulate.
+    """
+
+    def __init__(self, precision=3):
+        self.precision = precision
+        self.scale = 10**precision
+        # the current point and the start of the subpath, rounded and multiplied by scale
+        self.current = None
+        self.start = None
+        # the command that can be omitted
+        self.implicit = None
+        self.parts = []
+
+    def number(self, x):
+        """formats a number, rounded to the precision"""
+        return self.integer(round(x * self.scale))
+
+    def integer(self, n):
+        """formats a rounded number, given as an integer multiple of 1/scale"""
+        (q, r) = divmod(abs(n), self.scale)
+        s = str(q) if q != 0 or r == 0 else ""
+        if r != 0:
+            s += "." + str(r).rjust(self.precision, "0").rstrip("0")
+        return "-" + s if n < 0 else s
+
+    def pair(self, x, y):
+        """formats a pair of coordinates"""
+        return f"{self.integer(x)},{self.integer(y)}"
+
+    def rounded(self, point):
+        """returns the rounded coordinates of the point"""
+        return (round(point.x * self.scale), round(point.y * self.scale))
+
+    def emit(self, candidates):
+        """writes the shortest of the candidates ``(command, arguments)``"""
+        (command, arguments) = min(
+            candidates, key=lambda c: len(c[1]) + (0 if c[0] == self.implicit else 1)
+        )
+        self.parts.append(" " + arguments if command == self.implicit else command + arguments)
+        # after a move, the coordinates are those of a line
+        self.implicit = {"M": "L", "m": "l", "Z": None}.get(command, command)
+
+    def move_to(self, point):
+        """starts a new subpath"""
+        (x, y) = self.rounded(point)
+        candidates = [("M", self.pair(x, y))]
+        if self.current is not None:
+            candidates.append(("m", self.pair(x - self.current[0], y - self.current[1])))
+        self.emit(candidates)
+        self.current = self.start = (x, y)
+
+    def line_to(self, point):
+        """writes a line"""
+        (x, y) = self.rounded(point)
+        (dx, dy) = (x - self.current[0], y - self.current[1])
+        if dy == 0:
+            candidates = [("H", self.integer(x)), ("h", self.integer(dx))]
+        elif dx == 0:
+            candidates = [("V", self.integer(y)), ("v", self.integer(dy))]
+        else:
+            candidates = [("L", self.pair(x, y)), ("l", self.pair(dx, dy))]
+        self.emit(candidates)
+        self.current = (x, y)
+
+    def segment(self, command, points, prefix=""):
+        """writes a command whose arguments are ``prefix`` followed by points,
+        the last of which is the new current point"""
+        rounded = [self.rounded(point) for point in points]
+        (cx, cy) = self.current
+        self.emit(
+            [
+                (command, prefix + " ".join(self.pair(x, y) for (x, y) in rounded)),
+                (command.lower(), prefix + " ".join(self.pair(x - cx, y - cy) for (x, y) in rounded)),
+            ]
+        )
+        self.current = rounded[-1]
+
+    def close(self):
+        """closes the subpath"""
+        self.emit([("Z", "")])
+        self.current = self.start
+
+    def __str__(self):
+        return "".join(self.parts)
+
+
 class SvgPath:
     """A path in SVG. Not all features are supported.
 
     Not implemented
-      - relative commands
-      - V/H (not worth it)
-      - Z (cycle)
       - S (Reflected Bezier)
       - T (Reflected Quadratic Bezier)
 
     """
 
-    def __init__(self, start_point, path_list=None):
+    def __init__(self, start_point, path_list=None, closed=False):
         self.current_point = start_point
         if path_list is None:
             self.path_list = []
         else:
             self.path_list = path_list
+        self.closed = closed
 
     def line_to(self, next_point):
         """Adds a line from the current_point to the next point"""
@@ -181,19 +289,39 @@ class SvgPath:
         self.path_list += [SVGQuadratic(self.current_point, next_point, control_point)]
         self.current_point = next_point
 
+    def close(self):
+        """Closes the path, which must end at its first point"""
+        self.closed = True
+
+    def encode(self, precision=3):
+        """returns the data of the path
+
+        :param precision: the number of decimals of the coordinates
+        :type precision: int
+        """
+        encoder = PathEncoder(precision)
+        encoder.move_to(self.path_list[0].first_point)
+        elements = self.path_list
+        if self.closed and isinstance(elements[-1], SVGLine):
+            # the last line is drawn by the closing command
+            elements = elements[:-1]
+        for element in elements:
+            element.encode(encoder)
+        if self.closed:
+            encoder.close()
+        return str(encoder)
+
     def __str__(self):
-        first_point = self.path_list[0].first_point
-        s = f"M {first_point}"
-        return s + "".join(str(i) for i in self.path_list)
+        return self.encode()
 
     def reverse(self):
         """return the reverse of the SVG path"""
         if len(self.path_list) == 0:
-            return SvgPath(self.current_point)
+            return SvgPath(self.current_point, closed=self.closed)
 
         reverse_list = [x.reverse() for x in self.path_list[::-1]]
         last_point = reverse_list[-1].next_point
-        return SvgPath(last_point, reverse_list)
+        return SvgPath(last_point, reverse_list, self.closed)
 
     def is_up(self):
         """return whether the path is drawn from left to right
@@ -204,63 +332,428 @@ class SvgPath:
         return self.path_list[0].is_up()
 
 
+class ImageCache:
+    """A cache for the images embedded in the SVG files, shared by all layers.
+
+    The images are identified by their content, so that identical files are encoded once.
+    Files are only read again if they were modified.
+
+    :param maxsize: the maximal total size (in bytes) of the encoded images in the cache
+    """
+
+    def __init__(self, maxsize: int = 64 * 2**20):
+        self.maxsize = maxsize
+        self.size = 0
+        # digest of the content of each file, along with the modification time and size of the file
+        self.files: dict[str, tuple[tuple[int, int], str]] = {}
+        # data URI of each content
+        self.entries: OrderedDict[str, str] = OrderedDict()
+
+    def get(self, path: str) -> tuple[str, str]:
+        """returns the digest of the image and its data URI"""
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        known = self.files.get(path)
+        if known is not None and known[0] == signature and known[1] in self.entries:
+            digest = known[1]
+        else:
+            with open(path, "rb") as f:
+                data = f.read()
+            digest = hashlib.sha256(data).hexdigest()
+            self.files[path] = (signature, digest)
+            if digest not in self.entries:
+                mime = mimetypes.guess_type(path)[0] or "image/png"
+                uri = f'data:{mime};base64,{str(base64.b64encode(data), "utf-8")}'
+                self.entries[digest] = uri
+                self.size += len(uri)
+                while self.size > self.maxsize and len(self.entries) > 1:
+                    (_, old) = self.entries.popitem(last=False)
+                    self.size -= len(old)
+        self.entries.move_to_end(digest)
+        return (digest, self.entries[digest])
+
+    def clear(self):
+        """empties the cache"""
+        self.files.clear()
+        self.entries.clear()
+        self.size = 0
+
+
+# shared by all layers
+image_cache = ImageCache()
+
+
+def _escape_cdata(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _escape_attrib(text):
+    return (
+        _escape_cdata(text)
+        .replace('"', "&quot;")
+        .replace("\r", "&#13;")
+        .replace("\n", "&#10;")
+        .replace("\t", "&#09;")
+    )
+
+
+class SvgWriter:
+    """Writes a SVG file, in chunks of about ``chunk_size`` characters.
+
+    The output is the same as the one of ``ET.tostringlist``, joined by newlines.
+
+    The elements of the layers are stored as items ``(tag, attributes, body)``,
+    where ``attributes`` is the list of the pairs ``(name, value)`` and ``body`` is
+    the rest of the element, already serialized.
+    """
+
+    def __init__(self, fs=None, chunk_size=2**16):
+        self.fs = sys.stdout if fs is None else fs
+        self.chunk_size = chunk_size
+        self.parts = []
+        self.size = 0
+        self.empty = True
+
+    def write(self, fragment):
+        """writes a fragment"""
+        if not self.empty:
+            self.parts.append("\n")
+        self.empty = False
+        self.parts.append(fragment)
+        self.size += len(fragment) + 1
+        if self.size > self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """writes the buffered fragments to the file"""
+        self.fs.write("".join(self.parts))
+        self.parts = []
+        self.size = 0
+
+    def close(self):
+        """writes the end of the file"""
+        self.parts.append("\n")
+        self.flush()
+
+    @staticmethod
+    def fragments(element):
+        """yields the fragments of an element, after its attributes"""
+        if element.text or len(element):
+            yield ">"
+            if element.text:
+                yield _escape_cdata(element.text)
+            for child in element:
+                yield from SvgWriter.element_fragments(child)
+            yield f"</{element.tag}>"
+        else:
+            yield " />"
+        if element.tail:
+            yield _escape_cdata(element.tail)
+
+    @staticmethod
+    def element_fragments(element):
+        """yields the fragments of an element"""
+        yield f"<{element.tag}"
+        for k, v in element.attrib.items():
+            yield f' {k}="{_escape_attrib(v)}"'
+        yield from SvgWriter.fragments(element)
+
+    @staticmethod
+    def body(element):
+        """returns the serialized element, after its attributes"""
+        return "\n".join(SvgWriter.fragments(element))
+
+    def start(self, tag, attributes):
+        """writes the start of a tag, up to its attributes"""
+        self.write(f"<{tag}")
+        for k, v in attributes:
+            self.write(f' {k}="{_escape_attrib(v)}"')
+
+    def item(self, item):
+        """writes an item"""
+        (tag, attributes, body) = item
+        self.start(tag, attributes)
+        self.write(body)
+
+    @staticmethod
+    def item_fragments(item):
+        """returns an item, serialized"""
+        (tag, attributes, body) = item
+        return "\n".join([f"<{tag}", *(f' {k}="{_escape_attrib(v)}"' for (k, v) in attributes), body])
+
+    def element(self, element):
+        """writes an element"""
+        for fragment in self.element_fragments(element):
+            self.write(fragment)
+
+
+def _frames(spec, count):
+    """returns the set of frames (up to count) given by an overlay specification like ``"1,3-"``"""
+    frames = set()
+    for part in str(spec).split(","):
+        (first, dash, last) = part.partition("-")
+        first = int(first) if first.strip() else 1
+        last = first if not dash else int(last) if last.strip() else count
+        frames.update(range(first, last + 1))
+    return frames
+
+
 def pt_to_cm(x):
     """converts pt to cm"""
     return x * 2.54 / 72.27
 
 
 class SvgLayer(Layer):
-    """the SVG Layer"""
+    """the SVG Layer
+
+    If ``css_classes`` is set to True, the style attributes of the elements
+    are replaced at drawing time by classes, defined once in a ``<style>`` element.
+    Their names start with ``name_prefix``, so that the pictures inlined
+    in the same page do not share them.
+
+    Each image is embedded once, and all its pictures refer to it.
+    If ``embed_images`` is set to False, the pictures refer to the image files instead.
+
+    The drawing commands can be restricted to some frames of an animation
+    (see :meth:`frames`). The ids and the classes of the frames also start
+    with ``name_prefix``.
+    """
+
+    # how far (in SVG units) from the bounding box a primitive can be and still be drawn
+    cull_margin = 100
+    # whether draw replaces the style attributes of the elements by CSS classes
+    css_classes = False
+    # number of decimals of the coordinates in the paths
+    precision = 3
+    # whether the pictures are embedded in the file, or refer to the image files
+    embed_images = True
+    # if not None, the frames are animated, each one being shown for this number of seconds
+    frame_duration = None
+    # the prefix of the names of the classes and of the frames, which should differ
+    # for the pictures of the same page (None: computed from what is drawn)
+    name_prefix = None
 
     def __init__(self, transform=None):
         Layer.__init__(self, transform)
         self.namespaces = {"xlink": "http://www.w3.org/1999/xlink"}
         self.names = 0
-        # node = 1
-        # edge = 0
-        self.layers = {0: [], 1: []}
+        self.layers = ZBuffer()
+        # elements, or items as stored in the layers
         self.defs = []
+        # ids of the elements of the defs, by content
+        self.def_ids = {}
+        self.attributes = {}
+        # the frame specifications that apply to what is drawn
+        self.overlays = ()
+        self.frame_count = 0
         self.svgtransform = Transform(a=50, d=-50)
 
+    @property
+    def svgtransform(self):
+        """the transform from the user coordinates to the SVG coordinates"""
+        return self._svgtransform
+
+    @svgtransform.setter
+    def svgtransform(self, transform):
+        self._svgtransform = transform
+        self._fused_transform = None
+        self._inverse_fused_transform = None
+        # size of 1pt in the SVG coordinates
+        self.pt = pt_to_cm(1) * transform(Point(1, 1)).x
+
+    def _fuse_transform(self):
+        return self.svgtransform * self.transform
+
     def new_name(self):
         """return a new name for an id"""
         self.names += 1
         return f"{self.names}"
 
-    def add_to_layer(self, z_index, x):
-        """helper function"""
-        if z_index not in self.layers:
-            self.layers[z_index] = []
-        self.layers[z_index].append(x)
-
-    def picture(self, point, img_name, width, height, *, z_index=1):
-        tf = self.svgtransform * self.transform
-        r = Rectangle(Point(0, 0), self.svgtransform(Point(width, -height)))
-        with open(img_name, "rb") as f:
-            data = f.read()
+    def add_def(self, key, build, prefix):
+        """returns the id of the element of the defs identified by ``key``
+
+        The element is built by calling ``build`` the first time the key is seen,
+        and its id starts with ``prefix``.
+        """
+        try:
+            return self.def_ids[key]
+        except KeyError:
+            pass
+        element = build()
+        _id = f"{prefix}_{self.new_name()}"
+        element.set("id", _id)
+        self.defs.append(element)
+        self.def_ids[key] = _id
+        return _id
+
+    @contextmanager
+    def frames(self, spec):
+        """restricts what is drawn inside the context to some frames of an animation
+
+        :param spec: the frames, given as in beamer, for instance ``2``, ``"2-"`` or ``"1,3-4"``
+        :type spec: int or str
+
+        Contexts can be nested. All frames are in the same file, and what is drawn
+        outside of any context is written once.
+        By default, the first frame is shown, and the frame N is shown
+        when the file is opened with the fragment ``#frameN``, preceded by
+        ``name_prefix`` (which can be set to ``""`` to have predictable fragments).
+        If ``frame_duration`` is set, the frames are shown one after the other instead.
+        """
+        if not re.search(r"\d", str(spec)):
+            raise ValueError(spec)
+        _frames(spec, 0)
+        old = self.overlays
+        self.overlays = (*old, str(spec))
+        self.frame_count = max(self.frame_count, *map(int, re.findall(r"\d+", str(spec))))
+        try:
+            yield self
+        finally:
+            self.overlays = old
+
+    def add_to_layer(self, z_index, x, primitive=None):
+        """helper function
+
+        The element x is stored in a compact form (see :class:`SvgWriter`),
+        along with the frames where it is shown, if any.
+        ``primitive`` is the primitive that x comes from (None if x should always be drawn)"""
+        attributes = tuple(x.attrib.items())
+        # elements with the same style share their attributes
+        attributes = self.attributes.setdefault(attributes, attributes)
+        self.add_item(z_index, (x.tag, attributes, SvgWriter.body(x)), primitive)
+
+    def add_item(self, z_index, x, primitive=None):
+        """helper function: adds an element already in the compact form"""
+        bbox = None if primitive is None else self.bounding_box(primitive)
+        if self.overlays:
+            x = (self.overlays, x)
+        self.layers.add(z_index, x, bbox, primitive)
+
+    def fork(self):
+        child = Layer.fork(self)
+        child.layers = self.layers.fork()
+        child.defs = list(self.defs)
+        child.def_ids = dict(self.def_ids)
+        return child
+
+    def add_primitive(self, primitive):
+        self.add_primitives([primitive])
+
+    def add_primitives(self, primitives):
+        if not primitives:
+            return
+        first = primitives[0]
+        if first.kind in ("picture", "instance", "scope", "transformed"):
+            resolved = None
+        elif first.kind == "text":
+            resolved = self._resolve_text_style(first)
+        else:
+            resolved = self._resolve_path_style(first)
+        add = getattr(self, f"_add_{first.kind}")
+        for primitive in primitives:
+            add(primitive, resolved)
+
+    def _native_matrix(self, primitive):
+        """returns the SVG matrix that transforms the template of the primitive,
+        drawn in the SVG coordinates, to its place (None if it cannot be done natively)"""
+        template = primitive.template
+        m = self.fused_transform * primitive.transform * self.svgtransform.inverse
+        rigid = (
+            abs(m.a * m.a + m.c * m.c - 1) < 1e-9
+            and abs(m.b * m.b + m.d * m.d - 1) < 1e-9
+            and abs(m.a * m.b + m.c * m.d) < 1e-9
+        )
+        if not rigid or (
+            not m.is_translation
+            and any(p.kind in ("text", "picture") or p.labels for p in template.primitives)
+        ):
+            # the line widths would not be the same, or the texts would be rotated
+            return None
+        (linear, translation) = (PathEncoder(6).number, PathEncoder(self.precision).number)
+        return (
+            f"matrix({linear(m.a)} {linear(m.c)} {linear(m.b)} {linear(m.d)}"
+            f" {translation(m.e)} {translation(m.f)})"
+        )
+
+    def _render(self, template):
+        """returns the serialized items that draw the template in the SVG coordinates"""
+        # drawn by a layer that shares the defs and the names of this one
+        sub = copy.copy(self)
+        sub.layers = ZBuffer()
+        sub.transform = Transform()
+        sub.overlays = ()
+        template.replay(sub)
+        self.names = sub.names
+        return [SvgWriter.item_fragments(x) for (_, items) in sub.layers.levels() for x in items]
+
+    def _add_instance(self, primitive, resolved):
+        matrix = self._native_matrix(primitive)
+        if matrix is None:
+            self._replay_instance(primitive)
+            return
+        template = primitive.template
+        key = ("template", template, len(template.primitives), self.pt)
+        if key not in self.def_ids:
+            body = [">", *self._render(template), "</symbol>"]
+            _id = f"template_{self.new_name()}"
+            self.def_ids[key] = _id
+            self.defs.append(("symbol", (("overflow", "visible"), ("id", _id)), "\n".join(body)))
+        use = ET.Element("use", transform=matrix)
+        use.set("xlink:href", f"#{self.def_ids[key]}")
+        self.add_to_layer(primitive.z_index, use, primitive)
+
+    def _add_scope(self, primitive, resolved):
+        matrix = self._native_matrix(primitive)
+        if matrix is None:
+            self._replay_instance(primitive)
+            return
+        body = [">", *self._render(primitive.template), "</g>"]
+        self.add_item(primitive.z_index, ("g", (("transform", matrix),), "\n".join(body)), primitive)
+
+    def picture_size(self, primitive):
+        # the size is in centimeters, as the user coordinates without transform
+        r = Rectangle(Point(0, 0), self.svgtransform(Point(primitive.width, -primitive.height)))
+        return Point(r.width, r.height)
+
+    def _add_picture(self, primitive, resolved):
+        tf = self.fused_transform
+        point = primitive.points[0]
+        r = Rectangle(Point(0, 0), self.picture_size(primitive))
+        if not self.embed_images:
             image_node = ET.Element("image", width=str(r.width), height=str(r.height))
-            image_node.set(
-                "xlink:href",
-                f'data:image/png;base64,{str(base64.b64encode(data), "utf-8")}',
-            )
-            image_node.set("transform", f"translate({tf(point)-r.center})")
+            image_node.set("xlink:href", primitive.img_name)
             image_node.set("preserveAspectRatio", "none")
+        else:
+            (digest, uri) = image_cache.get(primitive.img_name)
+
+            def symbol():
+                # the image is stretched to the size given by each use
+                element = ET.Element("symbol", viewBox="0 0 1 1", preserveAspectRatio="none")
+                image = ET.Element("image", width="1", height="1", preserveAspectRatio="none")
+                image.set("xlink:href", uri)
+                element.append(image)
+                return element
+
+            _id = self.add_def(("image", digest), symbol, "img")
+            image_node = ET.Element("use", width=str(r.width), height=str(r.height))
+            image_node.set("xlink:href", f"#{_id}")
+        image_node.set("transform", f"translate({tf(point)-r.center})")
 
-            self.add_to_layer(z_index, image_node)
+        self.add_to_layer(primitive.z_index, image_node, primitive)
 
     def parse_stroke_width(self, style):
         """---------
         thickness
         ---------"""
         thickness = style.pop("thickness", 1)
-        pt = pt_to_cm(1) * self.svgtransform(Point(1, 1)).x
+        pt = self.pt
         return 0.4 * pt * thickness
 
     def parse_style(self, stroke_width, style, svg_style):
         
         
         # dash
-        pt = pt_to_cm(1) * self.svgtransform(Point(1, 1)).x
+        pt = self.pt
         if "dash" in style:
             dash = style.pop("dash")
             sw = stroke_width
@@ -305,19 +798,15 @@ class SvgLayer(Layer):
         svg_style["fill"] = fill
 
         if "shade" in style:
-            (a,b)= style.pop("shade")
-            name = f"grad_{self.new_name()}"
-            grad = ET.Element(
-                "linearGradient",
-                id=name,
-                x1 = "0%",
-                y1 = "0%",
-                x2 = "100%",
-                y2 = "0%"
-            )
-            grad.append(ET.Element("stop", {"offset": "0%", "stop-color":a}))
-            grad.append(ET.Element("stop",  {"offset":"100%","stop-color":b}))
-            self.defs.append(grad)
+            (a, b) = style.pop("shade")
+
+            def gradient():
+                grad = ET.Element("linearGradient", x1="0%", y1="0%", x2="100%", y2="0%")
+                grad.append(ET.Element("stop", {"offset": "0%", "stop-color": a}))
+                grad.append(ET.Element("stop", {"offset": "100%", "stop-color": b}))
+                return grad
+
+            name = self.add_def(("linearGradient", a, b), gradient, "grad")
             svg_style["fill"] = f"url(#{name})"
 
         if style.pop("rounded", False):
@@ -346,7 +835,7 @@ class SvgLayer(Layer):
         """internal function for arrows"""
         if "arrow" not in style:
             return
-        pt = pt_to_cm(1) * self.svgtransform(Point(1, 1)).x
+        pt = self.pt
 
         arrows = style["arrow"].split("-")
 
@@ -385,7 +874,7 @@ class SvgLayer(Layer):
                 Point(7 * X, -2 * x) - relative,
                 Point(8 * X / 3, -0.5 * x) - relative,
             )
-            arrow_svg_path = ET.Element("path", d=str(arrow_path), fill=svg.get("stroke"))
+            arrow_svg_path = ET.Element("path", d=arrow_path.encode(self.precision), fill=svg.get("stroke"))
             arrow.append(arrow_svg_path)
             return arrow
 
@@ -419,7 +908,7 @@ class SvgLayer(Layer):
                 Point(0.75 * X, -0.25 * x) - relative,
                 Point(3.5 * X, -2.5 * x) - relative,
             )
-            arrow_svg_path = ET.Element("path", d=str(arrow_path))
+            arrow_svg_path = ET.Element("path", d=arrow_path.encode(self.precision))
             arrow_svg_path.set("stroke-linecap", "round")
             arrow_svg_path.set("stroke-linejoin", "round")
             arrow_svg_path.set("stroke-dasharray", "none")
@@ -443,54 +932,77 @@ class SvgLayer(Layer):
             arrow.append(ET.Element("polyline", points=f"{Point(width, 0)} {Point(0, width)}"))
             return arrow
 
+        builders = {
+            ">": lambda first: default_arrow(False, first),
+            "<": lambda first: default_arrow(True, first),
+            "latex": lambda first: latex_arrow(False, first),
+            "xetal": lambda first: latex_arrow(True, first),
+            "x": lambda first: x_arrow(False, False),
+        }
+        # the markers are in the defs, so they do not inherit the colors of the path
+        (stroke, fill) = (svg.get("stroke"), svg.get("fill"))
+
+        def build(kind, first):
+            arrow = builders[kind](first)
+            if stroke is not None:
+                arrow.set("stroke", stroke)
+            if fill is not None:
+                arrow.set("fill", fill)
+            return arrow
+
         for i in range(2):
             if arrows[i] == "":
                 continue
-
-            if arrows[i] == ">":
-                arrow = default_arrow(False, i == 0)
-            elif arrows[i] == "<":
-                arrow = default_arrow(True, i == 0)
-            elif arrows[i] == "latex":
-                arrow = latex_arrow(False, i == 0)
-            elif arrows[i] == "xetal":
-                arrow = latex_arrow(True, i == 0)
-            elif arrows[i] == "x":
-                arrow = x_arrow(False, False)
-            else:
+            if arrows[i] not in builders:
                 raise NotImplementedError(arrows[i])
 
-            _id = self.new_name()
-            sub_path.set("marker-start" if i == 0 else "marker-end", f"url(#marker_{_id})")
-            arrow.set("id", f"marker_{_id}")
-            svg.append(arrow)
+            first = i == 0 and arrows[i] != "x"
+            key = ("marker", arrows[i], first, stroke_width, stroke, fill, pt)
+            _id = self.add_def(key, lambda kind=arrows[i], first=first: build(kind, first), "marker")
+            sub_path.set("marker-start" if i == 0 else "marker-end", f"url(#{_id})")
+
+    def _resolve_path_style(self, primitive):
+        """internal function
+        returns the stroke width, the attributes of the path,
+        the attributes of its labels and what remains of the style
+        """
 
-    def __path(self, svg_path, labels=None, per_style=None, z_index=0):
-        style = {}
-        style.update(params)        
-        if per_style is not None:
-            style.update(per_style)
-            
-        labels = {} if labels is None else labels
+        def compute():
+            style = dict(primitive.style)
+            style.pop("looseness", None)
+            if primitive.kind in ("polyline", "rectangle"):
+                style.pop("rounded", None)
+            stroke_width = self.parse_stroke_width(style)
+            svg_style = {"stroke-width": f"{stroke_width:2g}"}
+            self.parse_style(stroke_width, style, svg_style)
+            text_style = self.parse_text_style(style)
+            return (stroke_width, svg_style, text_style, style)
+
+        if primitive.style_key is None or "shade" in primitive.style:
+            # gradients belong to the defs of this layer, while the cache is shared by all layers
+            key = None
+        else:
+            key = ("svg", primitive.kind, primitive.style_key, self.pt)
+        return style_cache.get(key, compute)
+
+    def __path(self, svg_path, primitive, resolved):
+        labels = {} if primitive.labels is None else primitive.labels
+        z_index = primitive.z_index
 
         reverse_start = svg_path.is_up()
         reverse_end = not svg_path.reverse().is_up()
 
-        stroke_width = self.parse_stroke_width(style)
-        svg_style = {"stroke-width": f"{stroke_width:2g}"}
-        self.parse_style(stroke_width, style, svg_style)
-
-        text_style = self.parse_text_style(style)
+        (stroke_width, svg_style, text_style, style) = resolved
 
         _id = self.new_name()
 
         svg = ET.Element("g", svg_style)
-        sub_path = ET.Element("path", id=_id, d=str(svg_path))
+        sub_path = ET.Element("path", id=_id, d=svg_path.encode(self.precision))
         svg.append(sub_path)
 
         self.parse_arrows(stroke_width, style, svg, sub_path)
 
-        self.add_to_layer(z_index, svg)
+        self.add_to_layer(z_index, svg, primitive)
 
         if any(
             ("start" in position and reverse_start)
@@ -501,7 +1013,10 @@ class SvgLayer(Layer):
         ):
             self.add_to_layer(
                 z_index,
-                ET.Element("path", id=f"r-{_id}", d=str(svg_path.reverse()), display="none"),
+                ET.Element(
+                    "path", id=f"r-{_id}", d=svg_path.reverse().encode(self.precision), display="none"
+                ),
+                primitive,
             )
 
         for position in labels:
@@ -533,42 +1048,93 @@ class SvgLayer(Layer):
 
             text_path.text = str(labels[position])
             text_svg.append(text_path)
-            self.add_to_layer(z_index, text_svg)
+            self.add_to_layer(z_index, text_svg, primitive)
 
-    def line(self, p1, p2, labels=None, z_index=0, **style):
-        (p1, p2) = map(self.svgtransform * self.transform, (p1, p2))
+    def _add_line(self, primitive, resolved):
+        (p1, p2) = self.fused_transform.apply_many(primitive.points)
         svg_path = SvgPath(p1)
         svg_path.line_to(p2)
 
-        self.__path(svg_path, labels, style, z_index)
+        self.__path(svg_path, primitive, resolved)
 
-    def circle(self, p1, radius, labels=None, z_index=1, **style):
-        tf = self.svgtransform * self.transform
+    def __shape(self, tag, attributes, primitive, resolved):
+        """draws a native shape (circle, ellipse or rect) with the style of a path"""
+        (_, svg_style, _, _) = resolved
+        svg = ET.Element("g", svg_style)
+        svg.append(ET.Element(tag, attributes))
+        self.add_to_layer(primitive.z_index, svg, primitive)
 
-        rx = tf(p1).distance(tf(Point(radius, 0) + p1))
-        ry = tf(p1).distance(tf(Point(0, radius) + p1))
+    @staticmethod
+    def _native_shape(primitive, resolved):
+        """whether the primitive can be drawn as a native shape rather than a path"""
+        # labels and arrows need the path
+        return not primitive.labels and "arrow" not in resolved[3]
 
+    def _add_circle(self, primitive, resolved):
+        tf = self.fused_transform
+        p1 = primitive.points[0]
+        radius = primitive.radius
+
+        center = tf(p1)
         x1 = tf(p1 + Point(radius, 0))
-        x2 = tf(p1 - Point(radius, 0))
+        y1 = tf(p1 + Point(0, radius))
+        (u, v) = (x1 - center, y1 - center)
+        (rx, ry) = (center.distance(x1), center.distance(y1))
+
+        # the image of the x axis, without the translation of the transform
+        x_axis_rotation = u.angle * 180 / math.pi
+
+        if self._native_shape(primitive, resolved) and abs(u.x * v.x + u.y * v.y) <= 1e-9 * rx * ry:
+            # the axes of the ellipse are the images of the axes of the circle
+            number = PathEncoder(self.precision).number
+            attributes = {"cx": number(center.x), "cy": number(center.y)}
+            if abs(rx - ry) <= 1e-9 * rx:
+                self.__shape("circle", {**attributes, "r": number(rx)}, primitive, resolved)
+                return
+            attributes.update(rx=number(rx), ry=number(ry))
+            rotation = PathEncoder(6).number(x_axis_rotation)
+            if rotation != "0":
+                attributes["transform"] = f"rotate({rotation} {attributes['cx']} {attributes['cy']})"
+            self.__shape("ellipse", attributes, primitive, resolved)
+            return
 
-        x_axis_rotation = tf(Point(radius, 0)).angle * 180 / math.pi
+        x2 = tf(p1 - Point(radius, 0))
 
         svg_path = SvgPath(x1)
         svg_path.ellipse_to(x2, rx, ry, x_axis_rotation, 1, 1)
         svg_path.ellipse_to(x1, rx, ry, x_axis_rotation, 1, 1)
 
-        self.__path(svg_path, labels, style, z_index)
-
-
-    def rectangle(self, p1, p2, z_index=1, **style):
-        r = Rectangle(p1, p2)
-        self.polygon([r.northwest, r.northeast, r.southeast, r.southwest], z_index=z_index, **style)
-
-    def text(self, point, text, z_index=1, **per_style):
-        style = {}
-        style.update(params)        
-        if per_style is not None:
-            style.update(per_style)
+        self.__path(svg_path, primitive, resolved)
+
+    def _add_rectangle(self, primitive, resolved):
+        (sw, se, ne, nw) = primitive.points
+        if self._native_shape(primitive, resolved) and not primitive.style.get("rounded", False):
+            (sw, se, ne, nw) = self.fused_transform.apply_many(primitive.points)
+            (corner, u, v) = (nw, ne - nw, sw - nw)
+            if u.x * v.y - u.y * v.x < 0:
+                # the transform is a reflection: the rectangle is drawn from another corner
+                (corner, u, v) = (sw, se - sw, nw - sw)
+            (width, height) = (corner.distance(corner + u), corner.distance(corner + v))
+            if abs(u.x * v.x + u.y * v.y) <= 1e-9 * width * height:
+                number = PathEncoder(self.precision).number
+                attributes = {
+                    "x": number(corner.x),
+                    "y": number(corner.y),
+                    "width": number(width),
+                    "height": number(height),
+                }
+                rotation = PathEncoder(6).number(u.angle * 180 / math.pi)
+                if rotation != "0":
+                    attributes["transform"] = f"rotate({rotation} {attributes['x']} {attributes['y']})"
+                self.__shape("rect", attributes, primitive, resolved)
+                return
+            (sw, se, ne, nw) = primitive.points
+        self._add_polyline(replace(primitive, kind="polyline", points=[nw, ne, se, sw]), resolved)
+
+    def _resolve_text_style(self, primitive):
+        """internal function
+        returns the attributes of a text
+        """
 
         def compute_anchors(position):
             if position == "center":
@@ -600,28 +1166,30 @@ class SvgLayer(Layer):
                 y = -5
             return (x, y, align, valign)
 
-        position = style.pop("position", "center")
+        def compute():
+            style = dict(primitive.style)
+            position = style.pop("position", "center")
 
-        (x, y, align, valign) = compute_anchors(position)
+            (x, y, align, valign) = compute_anchors(position)
 
-        text_style = self.parse_text_style(style)
+            text_style = self.parse_text_style(style)
+            return {"x": str(x), "y": str(y), **text_style, "text-anchor": align, "dominant-baseline": valign}
 
-        text_node = ET.Element("text", x=str(x), y=str(y), **text_style)
-        text_node.set("text-anchor", align)
-        text_node.set("dominant-baseline", valign)
-        text_node.set("transform", f"translate({self.svgtransform(self.transform(point))})")
-        text_node.text = str(text)
-        self.add_to_layer(z_index, text_node)
+        key = None if primitive.style_key is None else ("svg text", primitive.style_key)
+        return style_cache.get(key, compute)
 
-    def edge(self, points, labels=None, *, closed=False, z_index=0, **style):
+    def _add_text(self, primitive, resolved):
+        text_node = ET.Element("text", resolved)
+        text_node.set("transform", f"translate({self.fused_transform(primitive.points[0])})")
+        text_node.text = primitive.text
+        self.add_to_layer(primitive.z_index, text_node, primitive)
 
-        tf = self.svgtransform * self.transform
-        angles = [x * math.pi / 180 for x in self.find_angles(points, closed=closed)]
-        if closed:
-            points.append(points[0])
-            angles.append(angles[0])
+    def _add_edge(self, primitive, resolved):
+        tf = self.fused_transform
+        points = primitive.points
+        angles = [x * math.pi / 180 for x in primitive.angles]
 
-        looseness = style.pop("looseness", 1)
+        looseness = primitive.style.get("looseness", 1)
 
         point = points[0]
         svg_path = SvgPath(tf(point))
@@ -635,10 +1203,11 @@ class SvgLayer(Layer):
             )
             point = newpoint
 
-        self.__path(svg_path, labels, style, z_index)
+        self.__path(svg_path, primitive, resolved)
 
-    def polyline(self, points, labels=None, *, closed=False, z_index=0, **style):
-        tf = self.svgtransform * self.transform
+    def _add_polyline(self, primitive, resolved):
+        tf = self.fused_transform
+        closed = primitive.closed
 
         def corners(p0, p1, p2):
             """returns points nears p1 to round the corners"""
@@ -652,10 +1221,11 @@ class SvgLayer(Layer):
                 t2 = 0.04 * ratio
             return (p0 * t1 + p1 * (1 - t1), p1 * (1 - t2) + p2 * t2)
 
+        points = primitive.points
         if closed:
-            points += [points[0]]
+            points = [*points, points[0]]
 
-        if style.pop("rounded", False) and len(points) > 2:
+        if primitive.style.get("rounded", False) and len(points) > 2:
             # first point
             if closed:
                 (_, afterp1) = corners(points[-2], points[0], points[1])
@@ -674,36 +1244,163 @@ class SvgLayer(Layer):
                 (beforep1, afterp1) = corners(points[-2], points[0], points[1])
                 svg_path.line_to(tf(beforep1))
                 svg_path.quadratic_to(tf(afterp1), tf(points[0]))
+                svg_path.close()
         else:
             # not rounded
-            svg_path = SvgPath(tf(points[0]))
+            points = tf.apply_many(points)
+            svg_path = SvgPath(points[0])
             for point in points[1:]:
-                svg_path.line_to(tf(point))
+                svg_path.line_to(point)
+            if closed:
+                svg_path.close()
 
-        self.__path(svg_path, labels, style, z_index)
+        self.__path(svg_path, primitive, resolved)
 
-    def draw(self, rect, fs=None, options=None, *, preamble=False):
-        tf = self.svgtransform * self.transform
-        rect = Rectangle.bounding_box(
-            [*map(tf, [rect.northwest, rect.northeast, rect.southeast, rect.southwest])]
-        )
+    @staticmethod
+    def unframe(x):
+        """returns the frame specifications of a stored item, and the item itself"""
+        return x if len(x) == 2 else ((), x)
 
-        svg = ET.Element(
-            "svg",
-            xmlns="http://www.w3.org/2000/svg",
-            width=str(rect.width),
-            height=str(rect.height),
-            viewBox=f"{rect.fst.x} {rect.fst.y} {rect.width} {rect.height}",
+    def frame_group(self, overlays, prefix=""):
+        """returns the group (without its content) of the items shown
+        on the frames given by the specifications
+
+        :param prefix: the prefix of the classes of the frames
+        """
+        count = self.frame_count
+        frames = set(range(1, count + 1))
+        for spec in overlays:
+            frames &= _frames(spec, count)
+        if self.frame_duration is None:
+            return ET.Element(
+                "g", {"class": " ".join([f"{prefix}f", *(f"{prefix}f{k}" for k in sorted(frames))])}
+            )
+        group = ET.Element("g", display="none")
+        group.append(
+            ET.Element(
+                "animate",
+                attributeName="display",
+                values=";".join("inline" if k in frames else "none" for k in range(1, count + 1)),
+                keyTimes=";".join(f"{k / count:.4g}" for k in range(count)),
+                calcMode="discrete",
+                dur=f"{count * self.frame_duration}s",
+                repeatCount="indefinite",
+            )
         )
-        for name in self.namespaces:
-            svg.set(f"xmlns:{name}", self.namespaces[name])
+        return group
 
-        if len(self.defs) > 0:
-            e = ET.Element("defs")
-            for i in self.defs:
-                e.append(i)
-            svg.append(e)
-        for i in sorted(self.layers.keys()):
-            svg.extend(self.layers[i])
+    @staticmethod
+    def with_classes(item, classes, prefix=""):
+        """returns the item where the style attributes are replaced by a class
 
-        print("\n".join(ET.tostringlist(svg, encoding="unicode")), file=fs)
+        :param classes: the classes already defined, indexed by their properties,
+            which is updated with the new class if needed
+        :param prefix: the prefix of the name of a new class
+        """
+        (tag, attributes, body) = item
+        properties = tuple((k, v) for (k, v) in attributes if k in CSS_PROPERTIES)
+        if not properties:
+            return item
+        name = classes.get(properties)
+        if name is None:
+            name = classes[properties] = f"{prefix}s{len(classes)}"
+        return (tag, (*((k, v) for (k, v) in attributes if k not in CSS_PROPERTIES), ("class", name)), body)
+
+    def _name_prefix(self, viewport):
+        """returns the prefix of the names of the classes and of the frames: ``name_prefix``,
+        or a digest of the items drawn in the viewport"""
+        if self.name_prefix is not None:
+            return self.name_prefix
+        digest = hashlib.blake2b(digest_size=4)
+        for _, items in self.layers.levels(viewport):
+            for x in items:
+                digest.update(repr(x).encode())
+        return f"p{digest.hexdigest()}-"
+
+    def draw(self, rect, fs=None, options=None, *, preamble=False, cull=True):
+        tf = self.fused_transform
+        rect = Rectangle.bounding_box(
+            tf.apply_many([rect.northwest, rect.northeast, rect.southeast, rect.southwest])
+        )
+
+        attributes = {
+            "xmlns": "http://www.w3.org/2000/svg",
+            "width": str(rect.width),
+            "height": str(rect.height),
+            "viewBox": f"{rect.fst.x} {rect.fst.y} {rect.width} {rect.height}",
+        }
+        for name in self.namespaces:
+            attributes[f"xmlns:{name}"] = self.namespaces[name]
+
+        viewport = rect.enlarge(self.cull_margin) if cull else None
+        rules = []
+        classes = None
+        animated = self.frame_count > 0 and self.frame_duration is None
+        prefix = self._name_prefix(viewport) if self.css_classes or animated else ""
+        if self.css_classes:
+            # the classes must be known before the items are written
+            classes = {}
+            for _, items in self.layers.levels(viewport):
+                for x in items:
+                    self.with_classes(self.unframe(x)[1], classes, prefix)
+            rules += [
+                f".{name}{{{';'.join(f'{k}:{v}' for (k, v) in properties)}}}"
+                for (properties, name) in classes.items()
+            ]
+        if animated:
+            # the first frame is shown by default, the others with their fragment
+            rules += [f".{prefix}f{{display:none}}", f".{prefix}f1{{display:inline}}"]
+            for k in range(1, self.frame_count + 1):
+                rules += [
+                    f"#{prefix}frame{k}:target~.{prefix}f{{display:none}}",
+                    f"#{prefix}frame{k}:target~.{prefix}f{k}{{display:inline}}",
+                ]
+
+        writer = SvgWriter(fs)
+        writer.start("svg", attributes.items())
+        empty = not rules and len(self.defs) == 0
+        if not empty:
+            writer.write(">")
+            if rules:
+                css = ET.Element("style")
+                css.text = "\n".join(rules)
+                writer.element(css)
+            if len(self.defs) > 0:
+                writer.start("defs", ())
+                writer.write(">")
+                for x in self.defs:
+                    if isinstance(x, tuple):
+                        writer.item(x)
+                    else:
+                        writer.element(x)
+                writer.write("</defs>")
+            if animated:
+                for k in range(1, self.frame_count + 1):
+                    writer.element(ET.Element("g", id=f"{prefix}frame{k}"))
+        groups = {}
+        for _, items in self.layers.levels(viewport):
+            current = ()
+            for x in items:
+                if empty:
+                    writer.write(">")
+                    empty = False
+                (overlays, x) = self.unframe(x)
+                if overlays != current:
+                    if current:
+                        writer.write("</g>")
+                    if overlays:
+                        if overlays not in groups:
+                            groups[overlays] = self.frame_group(overlays, prefix)
+                        group = groups[overlays]
+                        writer.start("g", group.attrib.items())
+                        writer.write(">")
+                        for child in group:
+                            writer.element(child)
+                    current = overlays
+                writer.item(x if classes is None else self.with_classes(x, classes))
+            if current:
+                writer.write("</g>")
+        writer.write(" />" if empty else "</svg>")
+        writer.close()
+        # the items that were spilled are no longer needed
+        self.layers.close()
@@ -1,11 +1,16 @@
 """Module that provides the TIKZ Layer"""
 
 # pylint: disable=invalid-name
+import copy
 import math
+import re
+from collections import Counter
+from contextlib import contextmanager
 
-from pygf.geometry import Point, Rectangle
+from pygf.display import ZBuffer, style_cache
+from pygf.geometry import Point, Rectangle, Transform
 from pygf.layer import Layer
-from pygf import params
+
 ALMOST_ZERO = 0.01
 
 
@@ -21,57 +26,296 @@ def _escape(x):
     return x
 
 
-# helper function
-def init_style(style):
-    s = {}
-    s.update(params)
-    if style is not None:
-        s.update(style)
-    return s
+def _overlay_lines(items):
+    """yields the lines of the items, where consecutive items shown on the same frames
+    are grouped in the same overlay commands"""
+    current = ()
+    for x in items:
+        (overlays, x) = x if isinstance(x, tuple) else ((), x)
+        if overlays != current:
+            if current:
+                yield "}" * len(current)
+            if overlays:
+                yield "".join(rf"\{command}<{spec}>{{" for (command, spec) in overlays)
+            current = overlays
+        yield x
+    if current:
+        yield "}" * len(current)
+
+
+# a path, as written by the layer: its options and what follows them
+_PATH = re.compile(r"\\path\[([^\]]*)\] ?(.*);\Z", re.DOTALL)
+
+# the options of the paths that can be merged: neither fills, shadings, arrows nor opacities
+_MERGEABLE_OPTIONS = frozenset(
+    {
+        "draw",
+        "line width",
+        "rounded corners",
+        "ultra thin",
+        "very thin",
+        "thin",
+        "semithick",
+        "thick",
+        "very thick",
+        "ultra thick",
+        "solid",
+        "dotted",
+        "densely dotted",
+        "loosely dotted",
+        "dashed",
+        "densely dashed",
+        "loosely dashed",
+        "dashdotted",
+        "dash dot",
+        "densely dashdotted",
+        "densely dash dot",
+        "loosely dashdotted",
+        "loosely dash dot",
+        "dashdotdotted",
+        "densely dashdotdotted",
+        "loosely dashdotdotted",
+        "dash dot dot",
+        "densely dash dot dot",
+        "loosely dash dot dot",
+    }
+)
+
+# escaped characters, braces and explicit coordinates
+_COORDINATE = re.compile(r"\\.|[{}]|\((-?\d+\.\d+,-?\d+\.\d+)\)")
+
+# escaped characters, braces and the options of paths and nodes (including the labels of paths)
+_OPTIONS = re.compile(r"\\.|[{}]|(?<=\\path\[|\\node\[|node \[)([^][{}#]+)(?=\])")
+
+
+def _mergeable(options):
+    "whether paths with these options can be merged"
+    return all(option.split("=", 1)[0] in _MERGEABLE_OPTIONS for option in options.split(","))
+
+
+def _merge_paths(items, limit):
+    """yields the items, where at most ``limit`` consecutive paths with the same options,
+    shown on the same frames, are merged into a single path with several subpaths"""
+    # the paths to merge, with their overlays and their options
+    (key, pending, bodies) = (None, [], [])
+    mergeable = {}
+    for x in items:
+        (overlays, line) = x if isinstance(x, tuple) else ((), x)
+        match = _PATH.match(line)
+        if match is not None and "node" not in match[2]:
+            if match[1] not in mergeable:
+                mergeable[match[1]] = _mergeable(match[1])
+            if not mergeable[match[1]]:
+                match = None
+        else:
+            match = None
+        if match is not None and (overlays, match[1]) == key and len(pending) < limit:
+            pending.append(x)
+            bodies.append(match[2])
+            continue
+        if len(pending) > 1:
+            merged = rf"\path[{key[1]}] " + "\n ".join(bodies) + ";"
+            yield (key[0], merged) if key[0] else merged
+        else:
+            yield from pending
+        if match is None:
+            (key, pending, bodies) = (None, [], [])
+            yield x
+        else:
+            (key, pending, bodies) = ((overlays, match[1]), [x], [match[2]])
+    if len(pending) > 1:
+        merged = rf"\path[{key[1]}] " + "\n ".join(bodies) + ";"
+        yield (key[0], merged) if key[0] else merged
+    else:
+        yield from pending
+
+
+def _find(pattern, line):
+    """yields the matches of the pattern whose first group is not empty, outside of
+    the groups of the line (which contain the texts)"""
+    depth = 0
+    for match in pattern.finditer(line):
+        if match[0] == "{":
+            depth += 1
+        elif match[0] == "}":
+            depth -= 1
+        elif match[1] and depth == 0:
+            yield match
+
+
+def _coordinates(line):
+    "yields the matches of the explicit coordinates of a line, if it is a path or a node"
+    if line.startswith((r"\path", r"\node")):
+        yield from _find(_COORDINATE, line)
+
+
+def _options(line):
+    "yields the matches of the options of the paths and the nodes of a line"
+    yield from _find(_OPTIONS, line)
+
+
+def _rename(x, find, names):
+    """returns the item where the texts found by ``find`` (in the first group
+    of its matches) that have a name are replaced by it"""
+    (overlays, line) = x if isinstance(x, tuple) else ((), x)
+    (parts, start) = ([], 0)
+    for match in find(line):
+        name = names.get(match[1])
+        if name is not None:
+            parts += [line[start : match.start(1)], name]
+            start = match.end(1)
+    if not parts:
+        return x
+    line = "".join(parts) + line[start:]
+    return (overlays, line) if overlays else line
+
 
 class TikzLayer(Layer):
-    """The Tikz Layer"""
+    """The Tikz Layer
+
+    The drawing commands can be restricted to some frames of a beamer
+    overlay (see :meth:`frames`), so that all the steps of an animation
+    are given by a single picture.
+    """
+
+    # how far (in cm) from the bounding box a primitive can be and still be drawn
+    cull_margin = 2
+    # the beamer commands that can be used by frames
+    overlay_commands = ("only", "visible", "uncover", "invisible")
+    # how many consecutive paths with the same options can be merged into a single path
+    merge_limit = 64
+    # how many times a coordinate must be used to be named by a \coordinate (None: never)
+    coordinate_threshold = 3
+    # how many times a list of options must be used to be named by a style (None: never)
+    style_threshold = 2
 
     def __init__(self, transform=None):
         Layer.__init__(self, transform)
-        self.layers = {0: [], 1: []}
+        self.layers = ZBuffer()
         self.names = 0
+        # definitions written at the beginning of the picture, and their names
+        self.defs = []
+        self.def_ids = {}
+        # the overlay commands that apply to what is drawn, as pairs (command, specification)
+        self.overlays = ()
+        self.has_overlays = False
+
+    @contextmanager
+    def frames(self, spec, command="only"):
+        """restricts what is drawn inside the context to some frames of a beamer overlay
+
+        :param spec: the overlay specification, for instance ``2``, ``"2-"`` or ``"1,3-4"``
+        :type spec: int or str
+        :param command: the beamer command to use (``only``, ``visible``, ``uncover`` or ``invisible``)
+        :type command: str
+
+        Contexts can be nested. With ``preamble=True``, the output is then
+        a beamer document with one page per frame.
+        """
+        if command not in self.overlay_commands:
+            raise ValueError(command)
+        old = self.overlays
+        self.overlays = (*old, (command, str(spec)))
+        self.has_overlays = True
+        try:
+            yield self
+        finally:
+            self.overlays = old
+
+    def add_to_layer(self, z_index, x, primitive=None):
+        """helper function
+
+        ``primitive`` is the primitive that x comes from (None if x should always be drawn)"""
+        bbox = None if primitive is None else self.bounding_box(primitive)
+        if self.overlays:
+            x = (self.overlays, x)
+        self.layers.add(z_index, x, bbox, primitive)
+
+    def fork(self):
+        child = Layer.fork(self)
+        child.layers = self.layers.fork()
+        child.defs = list(self.defs)
+        child.def_ids = dict(self.def_ids)
+        return child
+
+    def add_primitive(self, primitive):
+        self.add_primitives([primitive])
+
+    def add_primitives(self, primitives):
+        if not primitives:
+            return
+        first = primitives[0]
+        if first.kind in ("picture", "instance", "scope", "transformed"):
+            resolved = None
+        elif first.kind == "text":
+            resolved = self._resolve_text_style(first)
+        else:
+            resolved = self._resolve_style(first)
+        add = getattr(self, f"_add_{first.kind}")
+        for primitive in primitives:
+            add(primitive, resolved)
+
+    def _render(self, template):
+        """returns the commands that draw the template in its own coordinates"""
+        # drawn by a layer that shares the definitions and the names of this one
+        sub = copy.copy(self)
+        sub.layers = ZBuffer()
+        sub.transform = Transform()
+        sub.overlays = ()
+        template.replay(sub)
+        self.names = sub.names
+        return "\n".join(line for (_, items) in sub.layers.levels() for line in _overlay_lines(items))
+
+    def _cm(self, primitive):
+        """returns the option that transforms the template of the primitive to its place"""
+        # nodes are not transformed, as when the template is drawn directly
+        m = self.transform * primitive.transform
+        return f"cm={{{m.a:f},{m.c:f},{m.b:f},{m.d:f},({m.e:f},{m.f:f})}}"
+
+    def _add_instance(self, primitive, resolved):
+        template = primitive.template
+        key = (template, len(template.primitives))
+        if key not in self.def_ids:
+            body = self._render(template)
+            name = f"pygf template {len(self.def_ids) + 1}"
+            self.def_ids[key] = name
+            self.defs.append(f"\\tikzset{{{name}/.pic={{\n{body}\n}}}}")
+        self.add_to_layer(
+            primitive.z_index, rf"\pic[{self._cm(primitive)}] at (0,0) {{{self.def_ids[key]}}};", primitive
+        )
 
-    def add_to_layer(self, z_index, x):
-        """helper function"""
-        if z_index not in self.layers:
-            self.layers[z_index] = []
-        self.layers[z_index].append(x)
+    def _add_scope(self, primitive, resolved):
+        self.add_to_layer(
+            primitive.z_index,
+            f"\\begin{{scope}}[{self._cm(primitive)}]\n{self._render(primitive.template)}\n\\end{{scope}}",
+            primitive,
+        )
 
-    def picture(self, point, img_name, width, height, *, z_index=1):
+    def _add_picture(self, primitive, resolved):
         # pictures are NOT subject to the transform (only the position is)
         self.add_to_layer(
-            z_index,
-            rf"\node at ({self.transform(point)}) "
-            rf"{{\includegraphics[width={width:f}cm, height={height:f}cm]"
-            f"{{{img_name}}}}};",
+            primitive.z_index,
+            rf"\node at ({self.transform(primitive.points[0])}) "
+            rf"{{\includegraphics[width={primitive.width:f}cm, height={primitive.height:f}cm]"
+            f"{{{primitive.img_name}}}}};",
+            primitive,
         )
 
-    def text(self, point, text, z_index=1, **hints):
+    def _add_text(self, primitive, resolved):
         #  text is NOT subject to the transform (only the position is)
-        text = str(text)
-        opts = {}
-        hints = init_style(hints)
-        self._parse_text(hints, opts)
-        if "position" in hints:
-            x = hints.pop("position")
-            if x == "center":
-                pass
-            else:
-                opts.update({x: None})
-        #opts.update(hints)
+        text = primitive.text
+        options = resolved
         self.add_to_layer(
-            z_index,
-            f"\\node[{dic_to_list(opts)}] at ({self.transform(point)})" f"{{{_escape(text)}}};",
+            primitive.z_index,
+            f"\\node[{options}] at ({self.transform(primitive.points[0])})" f"{{{_escape(text)}}};",
+            primitive,
         )
 
-    def circle(self, p1, radius, labels=None, z_index=1, **style):
+    def _add_circle(self, primitive, resolved):
         tf = self.transform
+        p1 = primitive.points[0]
+        radius = primitive.radius
+        z_index = primitive.z_index
 
         pointx = tf(Point(radius, 0) + p1)
         pointy = tf(Point(0, radius) + p1)
@@ -83,38 +327,65 @@ class TikzLayer(Layer):
 
         x_axis_rotation = tf(Point(radius, 0)).angle * 180 / math.pi
 
-        tikz_style = {}
-        style = init_style(style)
-        text_style = {}        
-        self._parse_style(style, tikz_style)
-        self._parse_text(style, text_style)        
-        tikz_style.update(style)
+        (options, _) = resolved
         if rx != ry:
             self.add_to_layer(
                 z_index,
-                f"\\path[{dic_to_list(tikz_style)}] ({x}) "
+                f"\\path[{options}] ({x}) "
                 f"circle[x radius={rx:2f}, y radius={ry:2f}, rotate={x_axis_rotation:2f}];",
+                primitive,
             )
         else:
             self.add_to_layer(
                 z_index,
-                f"\\path[{dic_to_list(tikz_style)}] ({x}) " f"circle[radius={rx:2f}];",
+                f"\\path[{options}] ({x}) " f"circle[radius={rx:2f}];",
+                primitive,
             )
 
-    def rectangle(self, p1, p2, z_index=1, **style):
-        r = Rectangle(p1, p2)
-        tikz_style = {}
-        style = init_style(style)
-        text_style = {}
-        self._parse_style(style, tikz_style)
-        self._parse_text(style, text_style)
-        tikz_style.update(style)        
-        (sw, se, nw, ne) = map(self.transform, (r.southwest, r.southeast, r.northwest, r.northeast))
+    def _add_rectangle(self, primitive, resolved):
+        (options, _) = resolved
+        (sw, se, ne, nw) = self.transform.apply_many(primitive.points)
         self.add_to_layer(
-            z_index,
-            f"\\path[{dic_to_list(tikz_style)}]" f"({sw}) -- ({se}) -- ({ne}) -- ({nw}) -- cycle;",
+            primitive.z_index,
+            f"\\path[{options}]" f"({sw}) -- ({se}) -- ({ne}) -- ({nw}) -- cycle;",
+            primitive,
         )
 
+    def _resolve_style(self, primitive):
+        """returns the options of a path and the options of its labels, as strings"""
+
+        def compute():
+            style = dict(primitive.style)
+            style.pop("looseness", None)
+            tikz_style = {}
+            text_style = {}
+            self._parse_style(style, tikz_style)
+            self._parse_text(style, text_style)
+            tikz_style.update(style)
+            return (dic_to_list(tikz_style), dic_to_list(text_style))
+
+        key = None if primitive.style_key is None else ("tikz", primitive.style_key)
+        return style_cache.get(key, compute)
+
+    def _resolve_text_style(self, primitive):
+        """returns the options of a text node, as a string"""
+
+        def compute():
+            opts = {}
+            hints = dict(primitive.style)
+            self._parse_text(hints, opts)
+            if "position" in hints:
+                x = hints.pop("position")
+                if x == "center":
+                    pass
+                else:
+                    opts.update({x: None})
+            #opts.update(hints)
+            return dic_to_list(opts)
+
+        key = None if primitive.style_key is None else ("tikz text", primitive.style_key)
+        return style_cache.get(key, compute)
+
     def _parse_thickness(self, gen_style, tikz_style):
         if "thickness" not in gen_style:
             return
@@ -244,16 +515,12 @@ class TikzLayer(Layer):
         a = p.angle * 180 / math.pi
         return int(a * 10 + 0.5) / 10
 
-    def line(self, p1, p2, labels=None, *, z_index=0, **style):
-        (p1, p2) = map(self.transform, (p1, p2))
+    def _add_line(self, primitive, resolved):
+        (p1, p2) = self.transform.apply_many(primitive.points)
+        labels = primitive.labels
         s = ""
-        style = init_style(style)        
-        tikz_style = {}
-        text_style = {}
-        self._parse_style(style, tikz_style)
-        self._parse_text(style, text_style)
-        tikz_style.update(style)
-        s += f"\\path[{dic_to_list(tikz_style)}] ({p1}) -- ({p2})"
+        (options, text_options) = resolved
+        s += f"\\path[{options}] ({p1}) -- ({p2})"
 
         if (abs((p2 - p1).angle) - math.pi / 2) < ALMOST_ZERO:
             # hack
@@ -267,37 +534,30 @@ class TikzLayer(Layer):
                 text = _escape(labels[label])
 
                 if label == "above":
-                    s += f" node [{dic_to_list(text_style)},sloped,pos=0.5,above]"
+                    s += f" node [{text_options},sloped,pos=0.5,above]"
                 elif label == "below":
-                    s += f" node [{dic_to_list(text_style)},sloped,pos=0.5,below]"
+                    s += f" node [{text_options},sloped,pos=0.5,below]"
                 elif label == "above start":
-                    s += f" node [{dic_to_list(text_style)},sloped,pos=0,above {'right' if not reverse_start else 'left'}]"
+                    s += f" node [{text_options},sloped,pos=0,above {'right' if not reverse_start else 'left'}]"
                 elif label == "below start":
-                    s += f" node [{dic_to_list(text_style)},sloped,pos=0,below {'right' if not reverse_start else 'left'}]"
+                    s += f" node [{text_options},sloped,pos=0,below {'right' if not reverse_start else 'left'}]"
                 elif label == "above end":
-                    s += f" node [{dic_to_list(text_style)},sloped,pos=1,above {'left' if not reverse_end else 'right'}]"
+                    s += f" node [{text_options},sloped,pos=1,above {'left' if not reverse_end else 'right'}]"
                 elif label == "below end":
-                    s += f" node [{dic_to_list(text_style)},sloped,pos=1,below {'left' if not reverse_end else 'right'}]"
+                    s += f" node [{text_options},sloped,pos=1,below {'left' if not reverse_end else 'right'}]"
                 s += f"{{{text}}}"
-        self.add_to_layer(z_index, s + ";")
+        self.add_to_layer(primitive.z_index, s + ";", primitive)
 
-    def edge(self, points, labels=None, *, closed=False, z_index=0, **style):
-        list_angles = self.find_angles(points, closed=closed)
-        if closed:
-            points.append(points[0])
-            list_angles.append(list_angles[0])
+    def _add_edge(self, primitive, resolved):
+        list_angles = primitive.angles
+        labels = primitive.labels
 
-        points = [*map(self.transform, points)]
+        points = self.transform.apply_many(primitive.points)
 
         s = ""
 
-        looseness = style.pop("looseness", 1)
-        tikz_style = {}
-        text_style = {}
-        style = init_style(style)                
-        self._parse_style(style, tikz_style)        
-        self._parse_text(style, text_style)        
-        tikz_style.update(style)
+        looseness = primitive.style.get("looseness", 1)
+        (options, text_options) = resolved
 
         
 
@@ -319,47 +579,44 @@ class TikzLayer(Layer):
             for label in labels:
                 text = _escape(labels[label])
                 if label == "above start":
-                    code = f"node [{dic_to_list(text_style)},sloped,pos=0,above {'right' if not reverse_start else 'left'}]"
+                    code = f"node [{text_options},sloped,pos=0,above {'right' if not reverse_start else 'left'}]"
                     code += f"{{{text}}} "
                     list_edges[1] = list_edges[1] + code
                 elif label == "below start":
-                    code = f"node [{dic_to_list(text_style)},sloped,pos=0,below {'right' if not reverse_start else 'left'}]"
+                    code = f"node [{text_options},sloped,pos=0,below {'right' if not reverse_start else 'left'}]"
                     code += f"{{{text}}} "
                     list_edges[1] = list_edges[1] + code
                 elif label == "above":
-                    code = f"node [{dic_to_list(text_style)},sloped,pos=0.5,above]"
+                    code = f"node [{text_options},sloped,pos=0.5,above]"
                     code += f"{{{text}}} "
                     n = (len(list_edges) - 1) // 2
                     n = 2 * (n // 2) + 1
                     list_edges[n] = list_edges[n] + code
                 elif label == "below":
-                    code = f"node [{dic_to_list(text_style)},sloped,pos=0.5,below]"
+                    code = f"node [{text_options},sloped,pos=0.5,below]"
                     code += f"{{{text}}} "
                     n = (len(list_edges) - 1) // 2
                     n = 2 * (n // 2) + 1
                     list_edges[n] = list_edges[n] + code
                 elif label == "above end":
-                    code = f" node [{dic_to_list(text_style)},sloped,pos=1,above {'left' if not reverse_end else 'right'}]"
+                    code = f" node [{text_options},sloped,pos=1,above {'left' if not reverse_end else 'right'}]"
                     code += f"{{{text}}}"
                     list_edges[-2] = list_edges[-2] + code
                 elif label == "below end":
-                    code = f" node [{dic_to_list(text_style)},sloped,pos=1,below {'left' if not reverse_end else 'right'}]"
+                    code = f" node [{text_options},sloped,pos=1,below {'left' if not reverse_end else 'right'}]"
                     code += f"{{{text}}}"
                     list_edges[-2] = list_edges[-2] + code
 
-        s = rf"\path[{dic_to_list(tikz_style)}] " + " ".join(list_edges)
+        s = rf"\path[{options}] " + " ".join(list_edges)
 
-        self.add_to_layer(z_index, s + ";")
+        self.add_to_layer(primitive.z_index, s + ";", primitive)
 
-    def polyline(self, points, labels=None, *, closed=False, z_index=0, **style):
-        points = [*map(self.transform, points)]
+    def _add_polyline(self, primitive, resolved):
+        points = self.transform.apply_many(primitive.points)
+        labels = primitive.labels
+        closed = primitive.closed
 
-        style = init_style(style)
-        text_style = {}        
-        tikz_style = {}
-        self._parse_style(style, tikz_style)
-        self._parse_text(style, text_style)        
-        tikz_style.update(style)
+        (options, text_options) = resolved
 
         reverse_start = abs((points[1] - points[0]).angle) > math.pi / 2
         if closed:
@@ -380,45 +637,51 @@ class TikzLayer(Layer):
             for label in labels:
                 text = _escape(labels[label])
                 if label == "above start":
-                    code = f"node [{dic_to_list(text_style)},sloped,pos=0,above {'right' if not reverse_start else 'left'}]"
+                    code = f"node [{text_options},sloped,pos=0,above {'right' if not reverse_start else 'left'}]"
                     code += f"{{{text}}} "
                     list_edges[1] = list_edges[1] + code
                 elif label == "below start":
-                    code = f"node [{dic_to_list(text_style)},sloped,pos=0,below {'right' if not reverse_start else 'left'}]"
+                    code = f"node [{text_options},sloped,pos=0,below {'right' if not reverse_start else 'left'}]"
                     code += f"{{{text}}} "
                     list_edges[1] = list_edges[1] + code
                 elif label == "above":
-                    code = f"node [{dic_to_list(text_style)},centered, sloped,pos=0.5,above]"
+                    code = f"node [{text_options},centered, sloped,pos=0.5,above]"
                     code += f"{{{text}}} "
                     n = (len(list_edges) - 1) // 2
                     n = 2 * (n // 2) + 1
                     list_edges[n] = list_edges[n] + code
                 elif label == "below":
-                    code = f"node [{dic_to_list(text_style)},centered, sloped,pos=0.5,below]"
+                    code = f"node [{text_options},centered, sloped,pos=0.5,below]"
                     code += f"{{{text}}} "
                     n = (len(list_edges) - 1) // 2
                     n = 2 * (n // 2) + 1
                     list_edges[n] = list_edges[n] + code
                 elif label == "above end":
-                    code = f" node [{dic_to_list(text_style)},sloped,pos=1,above {'left' if not reverse_end else 'right'}]"
+                    code = f" node [{text_options},sloped,pos=1,above {'left' if not reverse_end else 'right'}]"
                     code += f"{{{text}}}"
                     list_edges[-2] = list_edges[-2] + code
                 elif label == "below end":
-                    code = f" node [{dic_to_list(text_style)},sloped,pos=1,below {'left' if not reverse_end else 'right'}]"
+                    code = f" node [{text_options},sloped,pos=1,below {'left' if not reverse_end else 'right'}]"
                     code += f"{{{text}}}"
                     list_edges[-2] = list_edges[-2] + code
 
-        s = rf"\path[{dic_to_list(tikz_style)}] " + " ".join(list_edges)
+        s = rf"\path[{options}] " + " ".join(list_edges)
 
-        self.add_to_layer(z_index, s + ";")
+        self.add_to_layer(primitive.z_index, s + ";", primitive)
 
-    def draw(self, rect, fs=None, options=None, *, preamble=False):
-        if options is None:
-            options = {}
+    def draw(self, rect, fs=None, options=None, *, preamble=False, cull=True):
+        # the options may be shared by several layers
+        options = {} if options is None else dict(options)
 
         if preamble:
             print(
-                r"""\documentclass{standalone}
+                (
+                    # beamer loads xcolor itself
+                    r"\PassOptionsToPackage{svgnames}{xcolor}" "\n" r"\documentclass[beamer]{standalone}"
+                    if self.has_overlays
+                    else r"\documentclass{standalone}"
+                )
+                + r"""
 \usepackage[svgnames]{xcolor}
 \usepackage{tikz}
 \usepackage{mathtools}
@@ -428,8 +691,12 @@ class TikzLayer(Layer):
             )
 
             print(r"\begin{document}", file=fs)
+            if self.has_overlays:
+                print(r"\begin{standaloneframe}", file=fs)
 
         clip = options.pop("clip", True)
+        # without clipping, what is outside of the bounding box is visible
+        cull = cull and clip
 
         if options == {}:
             print(r"\begin{tikzpicture}", file=fs)
@@ -441,13 +708,60 @@ class TikzLayer(Layer):
         tf = self.transform
 
         rect = Rectangle.bounding_box(
-            [*map(tf, [rect.northwest, rect.northeast, rect.southeast, rect.southwest])]
+            tf.apply_many([rect.northwest, rect.northeast, rect.southeast, rect.southwest])
         )
 
+        viewport = rect.enlarge(self.cull_margin) if cull else None
+
+        # the coordinates and the options that are used often enough are named
+        (coordinates, styles) = (Counter(), Counter())
+        if self.coordinate_threshold is not None or self.style_threshold is not None:
+            for _, items in self.layers.levels(viewport):
+                if self.merge_limit > 1:
+                    items = _merge_paths(items, self.merge_limit)
+                for x in items:
+                    line = x[1] if isinstance(x, tuple) else x
+                    if self.coordinate_threshold is not None:
+                        coordinates.update(match[1] for match in _coordinates(line))
+                    if self.style_threshold is not None:
+                        styles.update(match[1] for match in _options(line))
+        names = {}
+        for coordinate, count in coordinates.items():
+            if count >= self.coordinate_threshold:
+                names[coordinate] = f"c{len(names) + 1}"
+        style_names = {}
+        for style, count in styles.items():
+            if count >= self.style_threshold:
+                style_names[style] = f"s{len(style_names) + 1}"
+
+        if style_names:
+            # the styles are local to the picture
+            print(r"\tikzset{", file=fs)
+            print(",\n".join(f"{name}/.style={{{style}}}" for (style, name) in style_names.items()), file=fs)
+            print("}", file=fs)
+        for definition in self.defs:
+            print(definition, file=fs)
         if clip:
             print(rf"\clip ({rect.northwest}) rectangle ({rect.southeast});", file=fs)
-        for i in sorted(self.layers.keys()):
-            print("\n".join(self.layers[i]), file=fs, end="\n")
+        for coordinate, name in names.items():
+            print(rf"\coordinate ({name}) at ({coordinate});", file=fs)
+        for _, items in self.layers.levels(viewport):
+            if names:
+                items = (_rename(x, _coordinates, names) for x in items)
+            if self.merge_limit > 1:
+                items = _merge_paths(items, self.merge_limit)
+            if style_names:
+                items = (_rename(x, _options, style_names) for x in items)
+            empty = True
+            for line in _overlay_lines(items):
+                print(line, file=fs)
+                empty = False
+            if empty:
+                print(file=fs)
         print(r"\end{tikzpicture}", file=fs)
         if preamble:
+            if self.has_overlays:
+                print(r"\end{standaloneframe}", file=fs)
             print(r"\end{document}", file=fs)
+        # the items that were spilled are no longer needed
+        self.layers.close()
@@ -0,0 +1,45 @@
+"""the commands that draw several items at once"""
+
+import io
+from fractions import Fraction
+
+import pytest
+
+from pygf.geometry import Point as p
+from pygf.geometry import Rectangle
+from pygf.svg import SvgLayer
+
+
+def draw(layer):
+    f = io.StringIO()
+    layer.draw(Rectangle(p(-1, -1), p(10, 10)), f)
+    return f.getvalue()
+
+
+def test_same_output():
+    bulk = SvgLayer()
+    bulk.lines([p(0, 0), p(1, 1)], [p(2, 0), p(3, 1)], [None, {"above": "x"}], draw="Red")
+    bulk.circles([p(0, 0), p(1, 1)], Fraction(1, 2), fill="Blue")
+    bulk.texts([p(5, 5)], ["t"])
+    single = SvgLayer()
+    single.line(p(0, 0), p(2, 0), draw="Red")
+    single.line(p(1, 1), p(3, 1), {"above": "x"}, draw="Red")
+    for center in (p(0, 0), p(1, 1)):
+        single.circle(center, Fraction(1, 2), fill="Blue")
+    single.text(p(5, 5), "t")
+    assert draw(bulk) == draw(single)
+
+
+def test_lengths():
+    layer = SvgLayer()
+    with pytest.raises(ValueError, match="starts and ends"):
+        layer.lines([p(0, 0), p(1, 1)], [p(2, 0)])
+    with pytest.raises(ValueError, match="labels"):
+        layer.lines([p(0, 0)], [p(2, 0)], [None, None])
+    with pytest.raises(ValueError, match="centers and radii"):
+        layer.circles([p(0, 0), p(1, 1)], [1])
+    with pytest.raises(ValueError, match="points and texts"):
+        layer.texts([p(0, 0)], ["a", "b"])
+    with pytest.raises(ValueError, match="point_lists and labels"):
+        layer.polylines([[p(0, 0), p(1, 1)]], [None, None])
+    assert draw(layer) == draw(SvgLayer())
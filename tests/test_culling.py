@@ -0,0 +1,54 @@
+"""culling: what meets the viewport is drawn, even when its position is outside"""
+
+import io
+
+from pygf.geometry import Point as p
+from pygf.geometry import Rectangle, Transform
+from pygf.layer import DisplayList
+from pygf.svg import SvgLayer
+from pygf.tikz import TikzLayer
+
+VIEWPORT = Rectangle(p(-1, -1), p(1, 1))
+
+
+def layers():
+    svg = SvgLayer()
+    svg.embed_images = False
+    return [svg, TikzLayer()]
+
+
+def draw(layer, cull=True):
+    f = io.StringIO()
+    layer.draw(VIEWPORT, f, cull=cull)
+    return f.getvalue()
+
+
+def test_pictures():
+    for layer in layers():
+        # the anchor is off screen, but the picture covers the whole viewport
+        layer.picture(p(8, 0), "visible.png", 20, 20)
+        layer.picture(p(30, 0), "hidden.png", 20, 20)
+        output = draw(layer)
+        assert "visible.png" in output
+        assert "hidden.png" not in output
+        assert "hidden.png" in draw(layer, cull=False)
+
+
+def test_texts():
+    for layer in layers():
+        # the size of the text is not known: it is always drawn
+        layer.text(p(4, 0), "a long label")
+        layer.text(p(100, 100), "far away")
+        output = draw(layer)
+        assert "a long label" in output
+        assert "far away" in output
+
+
+def test_instances():
+    template = DisplayList()
+    template.text(p(0, 0), "label")
+    template.line(p(0, 0), p(0.1, 0))
+    for layer in layers():
+        layer.place(template)
+        layer.place(template, Transform(e=4))
+        assert draw(layer) == draw(layer, cull=False)
@@ -0,0 +1,69 @@
+"""GridIndex, checked against a scan of all the rectangles"""
+
+import math
+import random
+
+from pygf.geometry import GridIndex, Rectangle
+from pygf.geometry import Point as p
+
+
+def random_rectangles(rng, count):
+    rectangles = []
+    for _ in range(count):
+        corner = p(rng.uniform(-50, 50), rng.uniform(-50, 50))
+        # some rectangles span many cells, and are kept aside by the index
+        size = rng.uniform(0, 40) if rng.random() < 0.1 else rng.uniform(0, 3)
+        rectangles.append(Rectangle(corner, corner + p(size, rng.uniform(0, size))))
+    return rectangles
+
+
+def distance(rect, point):
+    dx = max(rect.fst.x - point.x, 0, point.x - rect.snd.x)
+    dy = max(rect.fst.y - point.y, 0, point.y - rect.snd.y)
+    return math.hypot(dx, dy)
+
+
+def build(rectangles, cell_size):
+    index = GridIndex(cell_size)
+    for n, rect in enumerate(rectangles):
+        index.insert(rect, n)
+    return index
+
+
+def test_query():
+    rng = random.Random(1)
+    rectangles = random_rectangles(rng, 500)
+    for cell_size in (0.5, 2, 10):
+        index = build(rectangles, cell_size)
+        for _ in range(100):
+            corner = p(rng.uniform(-60, 60), rng.uniform(-60, 60))
+            rect = Rectangle(corner, corner + p(rng.uniform(0, 20), rng.uniform(0, 20)))
+            limit = rng.choice([None, rng.randrange(len(rectangles))])
+            expected = [
+                n
+                for (n, other) in enumerate(rectangles)
+                if (limit is None or n < limit) and other.intersects(rect)
+            ]
+            assert index.query(rect, limit) == expected
+
+
+def test_nearest():
+    rng = random.Random(2)
+    rectangles = random_rectangles(rng, 500)
+    for cell_size in (0.5, 2, 10):
+        index = build(rectangles, cell_size)
+        for _ in range(100):
+            # some points are far from all the rectangles
+            point = p(rng.uniform(-100, 100), rng.uniform(-100, 100))
+            limit = rng.choice([None, 1 + rng.randrange(len(rectangles))])
+            candidates = rectangles if limit is None else rectangles[:limit]
+            expected = min(range(len(candidates)), key=lambda n: (distance(candidates[n], point), n))
+            assert index.closest(point, limit) == (expected, distance(candidates[expected], point))
+            if limit is None:
+                assert index.nearest(point) == expected
+
+
+def test_empty():
+    index = GridIndex(1)
+    assert index.query(Rectangle(p(0, 0), p(1, 1))) == []
+    assert index.nearest(p(0, 0)) is None
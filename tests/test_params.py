@@ -0,0 +1,106 @@
+"""Params: the changes made in a context are local to the thread or task"""
+
+import asyncio
+import io
+import threading
+
+from pygf import Params, params
+from pygf.geometry import Point as p
+from pygf.geometry import Rectangle
+from pygf.svg import SvgLayer
+
+
+def test_global_changes():
+    local = Params({"draw": "black"})
+    version = local.version
+    local["fill"] = "red"
+    assert local["fill"] == "red"
+    assert local.version != version
+    # the changes outside a context are seen by all the threads
+    seen = []
+    thread = threading.Thread(target=lambda: seen.append(local["fill"]))
+    thread.start()
+    thread.join()
+    assert seen == ["red"]
+    del local["fill"]
+    assert "fill" not in local
+    assert dict(local) == {"draw": "black"}
+
+
+def test_context_restored():
+    local = Params({"draw": "black", "fill": "none"})
+    version = local.version
+    with local.context({"draw": "white"}):
+        assert local["draw"] == "white"
+        assert local.version != version
+        inner = local.version
+        local["fill"] = "red"
+        del local["draw"]
+        assert "draw" not in local
+        assert local.version != inner
+        with local.context({"draw": "blue"}):
+            assert dict(local) == {"draw": "blue", "fill": "red"}
+        assert dict(local) == {"fill": "red"}
+    assert dict(local) == {"draw": "black", "fill": "none"}
+    assert local.version == version
+
+
+def test_threads():
+    local = Params({"draw": "black"})
+    barrier = threading.Barrier(2)
+    seen = []
+
+    def other():
+        # waits until the main thread is in its context
+        barrier.wait()
+        seen.append(local["draw"])
+        barrier.wait()
+
+    thread = threading.Thread(target=other)
+    thread.start()
+    with local.context({"draw": "white"}):
+        barrier.wait()
+        barrier.wait()
+    thread.join()
+    assert seen == ["black"]
+
+
+def test_tasks():
+    local = Params({"draw": "black"})
+
+    async def task(color):
+        with local.context({"draw": color}):
+            await asyncio.sleep(0)
+            local["fill"] = color
+            await asyncio.sleep(0)
+            return (local["draw"], local["fill"])
+
+    async def main():
+        return await asyncio.gather(*(task(color) for color in ("red", "green", "blue")))
+
+    assert asyncio.run(main()) == [(c, c) for c in ("red", "green", "blue")]
+    assert dict(local) == {"draw": "black"}
+
+
+def test_concurrent_drawings():
+    barrier = threading.Barrier(6)
+    output = {}
+
+    def render(color):
+        with params.context({"draw": color}):
+            barrier.wait()
+            layer = SvgLayer()
+            layer.line(p(0, 0), p(1, 1))
+            f = io.StringIO()
+            layer.draw(Rectangle(p(0, 0), p(1, 1)), f)
+            output[color] = f.getvalue()
+
+    colors = ["red", "green", "blue", "cyan", "magenta", "yellow"]
+    threads = [threading.Thread(target=render, args=(color,)) for color in colors]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for color in colors:
+        assert f'stroke="{color}"' in output[color]
+        assert all(f'stroke="{other}"' not in output[color] for other in colors if other != color)
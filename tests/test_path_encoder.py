@@ -0,0 +1,165 @@
+"""SVG path data: hand-written examples, and random paths parsed back"""
+
+import random
+import re
+
+from pygf.geometry import Point as p
+from pygf.svg import SVGBezier, SVGEllipse, SVGLine, SvgPath, SVGQuadratic
+
+# number of arguments of each command
+ARGUMENTS = {"M": 2, "L": 2, "H": 1, "V": 1, "C": 6, "Q": 4, "A": 7, "Z": 0}
+
+
+def path(start, *points, closed=False):
+    result = SvgPath(start)
+    for point in points:
+        result.line_to(point)
+    if closed:
+        result.close()
+    return result
+
+
+def test_lines():
+    # horizontal and vertical lines, and the last line drawn by the closing command
+    assert path(p(0, 0), p(10, 0), p(10, 5), p(0, 0), closed=True).encode(0) == "M0,0H10V5Z"
+    # relative coordinates when they are shorter, and the repeated command omitted
+    data = path(p(100, 100), p(101, 102), p(102, 104), p(150, 104), p(150, 100)).encode(0)
+    assert data == "M100,100l1,2 1,2h48v-4"
+    # the coordinates after a move are those of a line
+    assert path(p(100, 100), p(0, 0), p(0, 1)).encode(0) == "M100,100 0,0V1"
+
+
+def test_precision():
+    line = path(p(0.5, -0.75), p(1.126, -0.75))
+    assert line.encode(2) == "M.5,-.75h.63"
+    assert line.encode() == "M.5,-.75h.626"
+
+
+def test_curves():
+    curves = SvgPath(p(0, 0))
+    curves.curve_to(p(3, 0), p(1, 1), p(2, 1))
+    curves.quadratic_to(p(3, 3), p(4, 2))
+    curves.ellipse_to(p(0, 0), 2, 3, 45, 1, 0)
+    curves.close()
+    assert curves.encode() == "M0,0C1,1 2,1 3,0Q4,2 3,3A2 3 45 1 0 0,0Z"
+    assert curves.reverse().encode() == "M0,0A2 3 45 1 1 3,3Q4,2 3,0C2,1 1,1 0,0Z"
+    relative = SvgPath(p(200, 200))
+    relative.curve_to(p(203, 200), p(201, 201), p(202, 201))
+    assert relative.encode() == "M200,200c1,1 2,1 3,0"
+
+
+def parse(data):
+    """returns the segments drawn by the path data, as pairs (command, arguments)
+    with absolute coordinates, the closing command being a line"""
+    tokens = re.findall(r"[MLHVCQAZ]|-?(?:\d+\.?\d*|\.\d+)", data, re.IGNORECASE)
+    segments = []
+    (current, start) = ((0, 0), (0, 0))
+    command = None
+    i = 0
+    while i < len(tokens):
+        if re.fullmatch(r"[A-Z]", tokens[i], re.IGNORECASE):
+            command = tokens[i]
+            i += 1
+        elif command in "Mm":
+            # the coordinates after a move are those of a line
+            command = "L" if command == "M" else "l"
+        upper = command.upper()
+        if upper == "Z":
+            if abs(current[0] - start[0]) + abs(current[1] - start[1]) > 1e-9:
+                segments.append(("L", list(start)))
+            current = start
+            continue
+        count = ARGUMENTS[upper]
+        values = [float(x) for x in tokens[i : i + count]]
+        i += count
+        (cx, cy) = current if command.islower() else (0, 0)
+        if upper == "H":
+            values = [values[0] + cx, current[1]]
+        elif upper == "V":
+            values = [current[0], values[0] + cy]
+        elif upper == "A":
+            values = values[:5] + [values[5] + cx, values[6] + cy]
+        else:
+            values = [v + (cx if k % 2 == 0 else cy) for (k, v) in enumerate(values)]
+        current = (values[-2], values[-1])
+        if upper == "M":
+            start = current
+        else:
+            segments.append(({"H": "L", "V": "L"}.get(upper, upper), values))
+    return segments
+
+
+def segments(svg_path):
+    """returns the segments of the path, as parse gives them"""
+    result = []
+    for element in svg_path.path_list:
+        if isinstance(element, SVGLine):
+            points = [element.next_point]
+            result.append(("L", [v for point in points for v in (point.x, point.y)]))
+        elif isinstance(element, SVGBezier):
+            points = [element.first_control_point, element.second_control_point, element.next_point]
+            result.append(("C", [v for point in points for v in (point.x, point.y)]))
+        elif isinstance(element, SVGQuadratic):
+            points = [element.control_point, element.next_point]
+            result.append(("Q", [v for point in points for v in (point.x, point.y)]))
+        elif isinstance(element, SVGEllipse):
+            arguments = [
+                element.rx,
+                element.ry,
+                element.x_axis_rotation,
+                element.large_flag,
+                element.sweep_flag,
+            ]
+            result.append(("A", [*arguments, element.next_point.x, element.next_point.y]))
+    return result
+
+
+def random_path(rng):
+    def point():
+        # some coordinates repeat, so that H and V are used
+        if rng.random() < 0.3:
+            return p(rng.choice([0, 1.5, -2]), rng.uniform(-100, 100))
+        return p(rng.uniform(-100, 100), rng.uniform(-100, 100))
+
+    def add(svg_path, end):
+        kind = rng.randrange(4)
+        if kind == 0:
+            svg_path.line_to(end)
+        elif kind == 1:
+            svg_path.curve_to(end, point(), point())
+        elif kind == 2:
+            svg_path.quadratic_to(end, point())
+        else:
+            svg_path.ellipse_to(end, rng.uniform(0, 50), rng.uniform(0, 50), rng.uniform(-90, 90), 1, 0)
+
+    start = point()
+    svg_path = SvgPath(start)
+    for _ in range(rng.randrange(1, 8)):
+        add(svg_path, point())
+    if rng.random() < 0.5:
+        # a closed path ends where it began
+        add(svg_path, start)
+        svg_path.close()
+    return svg_path
+
+
+def same(segments1, segments2, precision):
+    if len(segments1) != len(segments2):
+        return False
+    # the relative coordinates are computed between rounded positions
+    tolerance = 10**-precision
+    return all(
+        c1 == c2 and len(v1) == len(v2) and all(abs(x - y) <= tolerance for (x, y) in zip(v1, v2))
+        for ((c1, v1), (c2, v2)) in zip(segments1, segments2)
+    )
+
+
+def test_random():
+    rng = random.Random(3)
+    for _ in range(500):
+        svg_path = random_path(rng)
+        for precision in (1, 3):
+            data = svg_path.encode(precision)
+            assert same(parse(data), segments(svg_path), precision), data
+            data = svg_path.reverse().encode(precision)
+            assert same(parse(data), segments(svg_path.reverse()), precision), data
@@ -0,0 +1,137 @@
+"""ZBuffer: the spilled and forked buffers give the same output as a buffer in memory"""
+
+import io
+import random
+
+import pytest
+
+from pygf.display import ZBuffer
+from pygf.geometry import Point as p
+from pygf.geometry import Rectangle
+from pygf.svg import SvgLayer
+from pygf.tikz import TikzLayer
+
+VIEWPORT = Rectangle(p(20, 20), p(60, 50))
+
+
+def random_items(rng, count):
+    items = []
+    for n in range(count):
+        corner = p(rng.uniform(0, 100), rng.uniform(0, 100))
+        bbox = None if rng.random() < 0.1 else Rectangle(corner, corner + p(rng.uniform(0, 5), 1))
+        items.append((rng.choice([0, 1, 2, -1]), f"item {n}", bbox))
+    return items
+
+
+def output(buffer, viewport=None):
+    return [(z_index, list(items)) for (z_index, items) in buffer.levels(viewport)]
+
+
+def fill(buffer, items):
+    for z_index, x, bbox in items:
+        buffer.add(z_index, x, bbox)
+    return buffer
+
+
+def test_spill():
+    rng = random.Random(5)
+    items = random_items(rng, 300)
+    expected = fill(ZBuffer(), items)
+    for threshold in (1, 7, 1000):
+        spilled = ZBuffer()
+        spilled.spill(threshold)
+        fill(spilled, items)
+        assert output(spilled) == output(expected)
+        assert output(spilled, VIEWPORT) == output(expected, VIEWPORT)
+        # the items already in memory are spilled too
+        late = fill(ZBuffer(), items)
+        late.spill(threshold)
+        assert output(late) == output(expected)
+
+
+def test_fork():
+    rng = random.Random(6)
+    (before, after, other) = (random_items(rng, 200), random_items(rng, 100), random_items(rng, 50))
+    for spill in (None, 5):
+        for index in (False, True):
+            buffer = ZBuffer()
+            if spill is not None:
+                buffer.spill(spill)
+            if index:
+                buffer.build_index(10)
+            fill(buffer, before)
+            child = buffer.fork()
+            fill(child, after)
+            fill(buffer, other)
+
+            expected_child = fill(ZBuffer(), before + after)
+            expected_parent = fill(ZBuffer(), before + other)
+            if index:
+                expected_child.build_index(10)
+                expected_parent.build_index(10)
+            assert output(child) == output(expected_child)
+            assert output(buffer) == output(expected_parent)
+            assert output(child, VIEWPORT) == output(expected_child, VIEWPORT)
+            assert output(buffer, VIEWPORT) == output(expected_parent, VIEWPORT)
+            # forks of forks
+            grandchild = child.fork()
+            fill(grandchild, other)
+            assert output(grandchild) == output(fill(ZBuffer(), before + after + other))
+
+
+def draw_lines(layer, start, count):
+    for n in range(start, start + count):
+        layer.line(p(n % 10, n // 10), p(n % 10 + 1, n // 10 + 2), labels={"above": str(n)}, draw="Red")
+        layer.circle(p(n % 10, n // 10), 0.3, fill="Blue")
+    return layer
+
+
+def draw(layer):
+    f = io.StringIO()
+    layer.draw(Rectangle(p(-1, -1), p(6, 8)), f)
+    return f.getvalue()
+
+
+def test_layers():
+    for cls in (SvgLayer, TikzLayer):
+        expected = draw(draw_lines(cls(), 0, 100))
+        spilled = cls()
+        spilled.layers.spill(10)
+        assert draw(draw_lines(spilled, 0, 100)) == expected
+
+        layer = draw_lines(cls(), 0, 60)
+        forked = draw_lines(layer.fork(), 60, 40)
+        draw_lines(layer, 100, 10)
+        assert draw(forked) == expected
+        assert draw(layer) == draw(draw_lines(draw_lines(cls(), 0, 60), 100, 10))
+
+
+def test_close():
+    items = random_items(random.Random(7), 100)
+    buffer = ZBuffer()
+    buffer.spill(5)
+    fill(buffer, items[:50])
+    child = buffer.fork()
+    fill(child, items[50:])
+    files = [f for segments in child.shared.values() for f in segments if not isinstance(f, list)]
+    files += child.files.values()
+    assert files
+    # the files shared with the fork are kept until both buffers are closed
+    buffer.close()
+    assert not any(f.closed for f in files)
+    assert output(child) == output(fill(ZBuffer(), items))
+    child.close()
+    assert all(f.closed for f in files)
+    with pytest.raises(ValueError):
+        output(child)
+
+
+def test_draw_closes():
+    for cls in (SvgLayer, TikzLayer):
+        layer = cls()
+        layer.layers.spill(10)
+        draw_lines(layer, 0, 100)
+        files = list(layer.layers.files.values())
+        draw(layer)
+        assert files
+        assert all(f.closed for f in files)